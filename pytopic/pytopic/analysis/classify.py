@@ -1,6 +1,9 @@
 from __future__ import division
 
 import math
+import itertools
+from pytopic.util import optional, parallel
+from pytopic.util.optional import numpy, sparse
 
 def normalize_and_log(counts):
     """
@@ -71,6 +74,101 @@ class NaiveBayes(object):
         return correct / len(data)
 
 
+class SparseNaiveBayes(object):
+    """
+    A Multinomial Naive Bayes classifier equivalent to NaiveBayes, but which
+    stores the log probabilities as a sparse label by feature matrix, and
+    classifies many documents at once with a sparse matrix product
+    """
+
+    batch_size = 1024
+
+    def __init__(self, labels, data):
+        optional.require('SparseNaiveBayes', scipy=True)
+
+        self.labels = sorted(set(labels))
+        label_index = {l: i for i, l in enumerate(self.labels)}
+        self.features = {}
+        for doc in data:
+            for word in doc:
+                self.features.setdefault(word, len(self.features))
+
+        rows = numpy.fromiter((label_index[l] for l in labels), numpy.intp)
+        shape = len(self.labels), len(rows)
+        doc_labels = sparse.csr_matrix((numpy.ones(len(rows)),
+                                        (rows, numpy.arange(len(rows)))),
+                                       shape)
+        counts = (doc_labels * self._feature_matrix(data)).tocsr()
+
+        label_counts = numpy.bincount(rows, minlength=len(self.labels))
+        with numpy.errstate(divide='ignore'):
+            self.log_priors = numpy.log(label_counts / len(rows))
+
+        # only observed counts are stored, and a document containing a
+        # feature which was never observed with a label gets probability 0
+        totals = numpy.asarray(counts.sum(axis=1)).ravel()
+        counts.data = numpy.log(counts.data / numpy.repeat(
+            totals, numpy.diff(counts.indptr)))
+        self.log_probs = counts.T.tocsr()
+        self.observed = self.log_probs.copy()
+        self.observed.data[:] = 1
+
+    def _feature_matrix(self, data):
+        # document by feature counts, ignoring features not seen in training
+        indptr = [0]
+        indices = []
+        for doc in data:
+            indices.extend(self.features[w] for w in doc if w in self.features)
+            indptr.append(len(indices))
+        values = numpy.ones(len(indices))
+        shape = len(indptr) - 1, len(self.features)
+        matrix = sparse.csr_matrix((values, indices, indptr), shape)
+        matrix.sum_duplicates()
+        return matrix
+
+    def classify(self, data):
+        """
+        SparseNaiveBayes.classify(iterable): object
+        Returns the label with the maximum posterior probability given the data
+        """
+
+        return self.classify_all([data])[0]
+
+    def classify_all(self, data):
+        """
+        SparseNaiveBayes.classify_all(list of iterable): list of object
+        Returns the label with the maximum posterior probability for each of
+        the given documents. Documents are scored batch_size at a time.
+        """
+
+        data = list(data)
+        predicted = []
+        for start in range(0, len(data), self.batch_size):
+            batch = data[start:start + self.batch_size]
+            features = self._feature_matrix(batch)
+            posteriors = (features * self.log_probs).toarray()
+            posteriors += self.log_priors
+
+            covered = (features * self.observed).toarray()
+            totals = numpy.asarray(features.sum(axis=1))
+            posteriors[covered < totals] = float('-inf')
+
+            best = posteriors.argmax(axis=1)
+            predicted.extend(self.labels[i] for i in best)
+        return predicted
+
+    def validate(self, labels, data):
+        """
+        SparseNaiveBayes.validate(list of object, list of iterable): float
+        Computes the accuracy of the model on a list of data, using the given
+        labels as the true labels
+        """
+
+        predicted = self.classify_all(data)
+        correct = sum(1 for l, p in zip(labels, predicted) if l == p)
+        return correct / len(data)
+
+
 def partition(labels, data, n):
     """
     partition(list of object, list of iterable, int): yield tuple of iterable
@@ -82,24 +180,35 @@ def partition(labels, data, n):
     data = [data[i::n] for i in range(n)]
 
     for i in range(n):
-        train_labels = sum(labels[:i] + labels[i + 1:], [])
-        train_data = sum(data[:i] + data[i + 1:], [])
+        chain = itertools.chain.from_iterable
+        train_labels = list(chain(labels[:i] + labels[i + 1:]))
+        train_data = list(chain(data[:i] + data[i + 1:]))
         yield (train_labels, train_data), (labels[i], data[i])
 
 
-def cross_fold_validation(labels, data, n=10):
+def cross_fold_validation(labels, data, n=10, processes=1):
     """
-    cross_fold_validation(list of object, list of iterable, int): float
+    cross_fold_validation(list of object, list of iterable, int, int): float
     After using partition to split the data n ways, trains up n models on the
     partition training data and averages the accuracy on the test sets. This is
-    a way to validate the features in the data.
+    a way to validate the features in the data. The folds are trained and
+    evaluated in parallel if more than one process is requested. The sparse
+    classifier is used when scipy is available.
     """
 
-    accuracy = 0
-    for train, test in partition(labels, data, n):
-        train_labels, train_data = train
-        classifier = NaiveBayes(train_labels, train_data)
+    state = {'labels': labels, 'data': data, 'n': n}
+    accuracies = parallel.pool_map(_validate_fold, range(n), state, processes)
+    return sum(accuracies) / n
+
 
-        test_labels, test_data = test
-        accuracy += classifier.validate(test_labels, test_data)
-    return accuracy / n
+def _validate_fold(i):
+    labels, data, n = (parallel.state[key] for key in ('labels', 'data', 'n'))
+    keep = lambda j: j % n != i
+    train_labels = [l for j, l in enumerate(labels) if keep(j)]
+    train_data = [doc for j, doc in enumerate(data) if keep(j)]
+
+    if not optional.available(scipy=True):
+        classifier = NaiveBayes(train_labels, train_data)
+    else:
+        classifier = SparseNaiveBayes(train_labels, train_data)
+    return classifier.validate(labels[i::n], data[i::n])
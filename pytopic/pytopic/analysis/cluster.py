@@ -5,7 +5,8 @@ from __future__ import division
 import os
 import itertools
 import math
-from pytopic.util import compute
+from pytopic.util import compute, data, optional
+from pytopic.util.optional import numpy
 
 class Clustering(object):
     """Abstraction for clusterings, both labeled data and inferred clusters"""
@@ -23,7 +24,7 @@ class Clustering(object):
         number of clusters and the cluster assignments for each document.
         """
 
-        return Clustering(range(model.K), model.k)
+        return Clustering(range(model.K), list(model.k))
 
     @classmethod
     def from_corpus(cls, corpus):
@@ -46,21 +47,22 @@ class Clustering(object):
         """
 
         labels = set()
-        data = {}
+        labelled = {}
 
         for root, _, files in os.walk(dirpath):
             for indexfile in files:
                 indexfile = os.path.join(root, indexfile)
                 labels.add(indexfile)
+                data.track_file(indexfile)
                 with open(indexfile) as filelist:
                     for filename in filelist:
                         filename = filename.strip()
                         if len(filename) > 0:
                             filename = os.path.join(data_dir, filename)
-                            data[filename] = indexfile
+                            labelled[filename] = indexfile
 
-        data = [data[corpus.titles[d]] for d in range(len(corpus))]
-        return Clustering(labels, data)
+        ordered = [labelled[corpus.titles[d]] for d in range(len(corpus))]
+        return Clustering(labels, ordered)
 
     @classmethod
     def from_repr(cls, state):
@@ -79,6 +81,34 @@ class Clustering(object):
     def __getitem__(self, index):
         return self.data[index]
 
+    def encode(self):
+        """
+        Clustering.encode(): return (list, numpy.ndarray)
+        Returns the labels as a list along with an integer array giving the
+        index of the label of each datum. The encoding is computed once and
+        cached, so the data should not be modified afterwards.
+        """
+
+        optional.require('Clustering.encode')
+
+        try:
+            return self._encoding
+        except AttributeError:
+            pass
+
+        labels = list(self.labels)
+        if labels == range(len(labels)):
+            codes = numpy.asarray(self.data, dtype=numpy.intp)
+        else:
+            values, inverse = numpy.unique(self.data, return_inverse=True)
+            positions = {label: i for i, label in enumerate(labels)}
+            lookup = numpy.array([positions[value] for value in values],
+                                 dtype=numpy.intp)
+            codes = lookup[inverse]
+
+        self._encoding = labels, codes
+        return self._encoding
+
 
 class Contingency(object):
     """Represents a contingency matrix for two Clusterings on the same data"""
@@ -144,12 +174,94 @@ class Contingency(object):
         self.pred = sorted_pred
 
 
+class ContingencyMatrix(Contingency):
+    """
+    Represents a contingency matrix for two Clusterings on the same data,
+    stored as a numpy array along with its marginals. The metric functions
+    below use vectorized versions of themselves for a ContingencyMatrix.
+    """
+
+    def __init__(self, gold, pred):
+        assert len(gold) == len(pred)
+
+        self.gold, gold_codes = gold.encode()
+        self.pred, pred_codes = pred.encode()
+        self.gold_index = {c: i for i, c in enumerate(self.gold)}
+        self.pred_index = {k: j for j, k in enumerate(self.pred)}
+
+        shape = len(self.gold), len(self.pred)
+        cells = gold_codes * shape[1] + pred_codes
+        counts = numpy.bincount(cells, minlength=shape[0] * shape[1])
+        self.matrix = counts.reshape(shape)
+
+        self.gold_sums = self.matrix.sum(axis=1)
+        self.pred_sums = self.matrix.sum(axis=0)
+        self.total = len(gold)
+
+    def __len__(self):
+        return self.total
+
+    def __getitem__(self, index):
+        c, k = index
+        return self.matrix[self.gold_index[c], self.pred_index[k]]
+
+
+def _numpy_f_measure(contingency):
+    matrix = contingency.matrix
+    gold_sums = contingency.gold_sums
+
+    # recall * precision / (recall + precision) is n_ck / (n_c + n_k)
+    denom = gold_sums[:, numpy.newaxis] + contingency.pred_sums
+    f_measures = matrix / numpy.where(denom == 0, 1, denom)
+
+    best_f_measures = f_measures.max(axis=1) if matrix.size else 0
+    return 2 * numpy.sum(best_f_measures * gold_sums) / contingency.total
+
+
+def _numpy_choose_2(counts):
+    counts = numpy.asarray(counts, dtype=numpy.float64)
+    return numpy.sum(counts * (counts - 1)) / 2
+
+
+def _numpy_ari(contingency):
+    a_part = _numpy_choose_2(contingency.gold_sums)
+    b_part = _numpy_choose_2(contingency.pred_sums)
+    index = _numpy_choose_2(contingency.matrix)
+
+    expected = (a_part * b_part) / compute.n_choose_2(contingency.total)
+    maximum = (a_part + b_part) / 2
+    return (index - expected) / (maximum - expected)
+
+
+def _numpy_entropy(counts, num_datums):
+    probs = counts[counts > 0] / num_datums
+    return -numpy.sum(probs * numpy.log(probs))
+
+
+def _numpy_variation_info(contingency):
+    num_datums = contingency.total
+    entropy_gold = _numpy_entropy(contingency.gold_sums, num_datums)
+    entropy_pred = _numpy_entropy(contingency.pred_sums, num_datums)
+
+    gold, pred = numpy.nonzero(contingency.matrix)
+    joint = contingency.matrix[gold, pred]
+    marginals = contingency.gold_sums[gold] * contingency.pred_sums[pred]
+    prob_ck = joint / num_datums
+    mutual_information = numpy.sum(
+        prob_ck * numpy.log(joint * num_datums / marginals))
+
+    return entropy_gold + entropy_pred - 2 * mutual_information
+
+
 def f_measure(contingency):
     """
     f_measure(Contingency): float
     Computes the F-1 measure for the given contingency matrix
     """
 
+    if isinstance(contingency, ContingencyMatrix):
+        return _numpy_f_measure(contingency)
+
     class_counts = {c: sum(contingency[c, k] for k in contingency.pred)
                     for c in contingency.gold}
     clust_counts = {k: sum(contingency[c, k] for c in contingency.gold)
@@ -179,6 +291,9 @@ def ari(contingency):
     Computes the average rand index for the given contingency matrix
     """
 
+    if isinstance(contingency, ContingencyMatrix):
+        return _numpy_ari(contingency)
+
     K = contingency.pred
     C = contingency.gold
 
@@ -199,6 +314,9 @@ def variation_info(contingency):
     Computes the variation of information for the given contingency matrix
     """
 
+    if isinstance(contingency, ContingencyMatrix):
+        return _numpy_variation_info(contingency)
+
     num_datums = len(contingency)
     gold_sums = {c:sum(contingency[c, k] for k in contingency.pred)
                  for c in contingency.gold}
@@ -1,6 +1,9 @@
 from __future__ import division
 
-from pytopic.util import data
+import os
+import itertools
+from pytopic.util import data, optional
+from pytopic.util.optional import numpy
 
 class XRefSet(object):
     """A collection of cross references within a Corpus"""
@@ -76,6 +79,409 @@ class Concordance(object):
         return len(self.index)
 
 
+class PostingIndex(object):
+    """
+    Provides an invert-index of words to documents like Concordance, but with
+    each posting list stored as sorted document ids which are delta and varint
+    encoded into a single byte array. Optionally, the positions of each word
+    within the documents are stored in the same way, allowing phrase lookups.
+    """
+
+    arrays = ['doc_bytes', 'doc_offsets', 'df',
+              'tf_bytes', 'tf_offsets', 'pos_bytes', 'pos_offsets']
+
+    def __init__(self, doc_bytes, doc_offsets, df, tf_bytes=None,
+                 tf_offsets=None, pos_bytes=None, pos_offsets=None):
+        optional.require('PostingIndex')
+
+        self.doc_bytes = doc_bytes
+        self.doc_offsets = doc_offsets
+        self.df = df
+        self.tf_bytes = tf_bytes
+        self.tf_offsets = tf_offsets
+        self.pos_bytes = pos_bytes
+        self.pos_offsets = pos_offsets
+        self.dirpath = None
+
+    @classmethod
+    def from_corpus(cls, corpus, positional=False):
+        """
+        PostingIndex.from_corpus(Corpus, bool): return PostingIndex
+        Builds the index for the given Corpus. If positional is True, the
+        positions of each word are stored as well.
+        """
+
+        optional.require('PostingIndex')
+
+        lengths = numpy.array([len(doc) for doc in corpus], numpy.int64)
+        words = numpy.fromiter(itertools.chain.from_iterable(corpus),
+                               numpy.int64, lengths.sum())
+        docs = numpy.repeat(numpy.arange(len(lengths)), lengths)
+        starts = numpy.cumsum(lengths) - lengths
+        positions = numpy.arange(len(words)) - numpy.repeat(starts, lengths)
+
+        # tokens are already ordered by document and position, so a stable
+        # sort by word orders the postings within each word
+        order = numpy.argsort(words, kind='mergesort')
+        words, docs, positions = words[order], docs[order], positions[order]
+
+        new_posting = numpy.ones(len(words), bool)
+        new_posting[1:] = (words[1:] != words[:-1]) | (docs[1:] != docs[:-1])
+        posting_starts = numpy.flatnonzero(new_posting)
+        posting_words = words[posting_starts]
+        posting_docs = docs[posting_starts]
+
+        V = len(corpus.vocab)
+        df = numpy.bincount(posting_words, minlength=V)
+        doc_bytes, doc_offsets = _encode_postings(
+            _deltas(posting_docs, posting_words), posting_words, V)
+        index = cls(doc_bytes, doc_offsets, df)
+
+        if positional:
+            tfs = numpy.diff(numpy.append(posting_starts, len(words)))
+            index.tf_bytes, index.tf_offsets = _encode_postings(
+                tfs, posting_words, V)
+            posting_ids = numpy.cumsum(new_posting)
+            index.pos_bytes, index.pos_offsets = _encode_postings(
+                _deltas(positions, posting_ids), words, V)
+
+        return index
+
+    @classmethod
+    def load(cls, dirpath, mmap=True):
+        """
+        PostingIndex.load(str, bool): return PostingIndex
+        Loads a PostingIndex saved to the given directory. If mmap is True,
+        the arrays are memory-mapped read-only instead of being read, so that
+        the index opens instantly. Raises IOError if the index is missing.
+        """
+
+        optional.require('PostingIndex')
+
+        mmap_mode = 'r' if mmap else None
+        arrays = {}
+        for name in cls.arrays:
+            filename = os.path.join(dirpath, name + '.npy')
+            if os.path.exists(filename):
+                arrays[name] = numpy.load(filename, mmap_mode)
+            elif name in ('doc_bytes', 'doc_offsets', 'df'):
+                raise IOError('{} does not exist'.format(filename))
+
+        index = cls(**arrays)
+        index.dirpath = dirpath
+        return index
+
+    def save(self, dirpath):
+        """
+        PostingIndex.save(str): return None
+        Saves the PostingIndex to the given directory in a format which can
+        be memory-mapped by PostingIndex.load. Once saved, the index pickles
+        as a reference to the directory, so caching it with data.file_cache
+        stores only the path and loading it from the cache maps the arrays.
+        Saving to data.cache_entry_dir() evicts the arrays with that entry.
+        """
+
+        data.ensure_dirs(os.path.join(dirpath, 'df.npy'))
+        for name in self.arrays:
+            filename = os.path.join(dirpath, name + '.npy')
+            array = getattr(self, name)
+            if array is not None:
+                numpy.save(filename, array)
+            elif os.path.exists(filename):
+                os.remove(filename)
+        self.dirpath = dirpath
+
+    def __reduce__(self):
+        if self.dirpath is not None:
+            return _load_posting_index, (self.dirpath,)
+        arrays = tuple(getattr(self, name) for name in self.arrays)
+        return PostingIndex, arrays
+
+    @property
+    def positional(self):
+        return self.pos_bytes is not None
+
+    def postings(self, word):
+        """
+        PostingIndex.postings(int): return numpy.ndarray
+        Returns the sorted ids of the documents containing the given token id
+        """
+
+        start, end = self.doc_offsets[word], self.doc_offsets[word + 1]
+        return numpy.cumsum(_varint_decode(self.doc_bytes[start:end]))
+
+    def positions(self, word, doc_id):
+        """
+        PostingIndex.positions(int, int): return numpy.ndarray
+        Returns the sorted positions of the given token id in the given
+        document. The index must have been built with positional postings.
+        """
+
+        docs, positions = self._word_positions(word)
+        start, end = numpy.searchsorted(docs, [doc_id, doc_id + 1])
+        return positions[start:end]
+
+    def lookup(self, *words):
+        """
+        PostingIndex.lookup(*int): return set of int
+        Returns the document ids which contain all of the given token ids
+        """
+
+        return set(self.lookup_array(*words).tolist())
+
+    def lookup_array(self, *words):
+        """
+        PostingIndex.lookup_array(*int): return numpy.ndarray
+        Returns the sorted document ids which contain all of the given token
+        ids. The posting lists are intersected smallest first, and each
+        remaining candidate is found in the next list by binary search, so
+        the cost is driven by the rarest word rather than the most common.
+        """
+
+        words = sorted(set(words), key=lambda word: self.df[word])
+        result = self.postings(words[0])
+        for word in words[1:]:
+            if len(result) == 0:
+                break
+            result = _intersect(result, self.postings(word))
+        return result
+
+    def lookup_phrase(self, *words):
+        """
+        PostingIndex.lookup_phrase(*int): return set of int
+        Returns the document ids in which the given token ids appear
+        consecutively. The index must have been built with positional
+        postings.
+        """
+
+        candidates = self.lookup_array(*words)
+        result = None
+        for offset, word in enumerate(words):
+            docs, positions = self._word_positions(word)
+            keep = numpy.in1d(docs, candidates)
+            keys = (docs[keep] << 32) + positions[keep] - offset
+            result = keys if result is None else _intersect(result, keys)
+        return set((result >> 32).tolist())
+
+    def _word_positions(self, word):
+        # returns the document and position of each occurrence of the word
+        if not self.positional:
+            raise RuntimeError('PostingIndex was built without positions')
+
+        start, end = self.tf_offsets[word], self.tf_offsets[word + 1]
+        tfs = _varint_decode(self.tf_bytes[start:end])
+        docs = numpy.repeat(self.postings(word), tfs)
+
+        start, end = self.pos_offsets[word], self.pos_offsets[word + 1]
+        positions = numpy.cumsum(_varint_decode(self.pos_bytes[start:end]))
+        starts = numpy.cumsum(tfs) - tfs
+        base = numpy.concatenate(([0], positions))[starts]
+        positions -= numpy.repeat(base, tfs)
+        return docs, positions
+
+    def __getitem__(self, word):
+        return set(self.postings(word).tolist())
+
+    def __len__(self):
+        return len(self.df)
+
+
+def _load_posting_index(dirpath):
+    # bound classmethods cannot be pickled, so __reduce__ refers to this
+    return PostingIndex.load(dirpath)
+
+
+def _deltas(values, groups):
+    # differences between consecutive values, restarting with each group
+    deltas = numpy.diff(values, prepend=0) if len(values) else values
+    starts = numpy.ones(len(groups), bool)
+    starts[1:] = groups[1:] != groups[:-1]
+    deltas[starts] = values[starts]
+    return deltas
+
+
+def _encode_postings(values, words, V):
+    # varint encodes values ordered by word, along with the byte offset of
+    # the values of each word
+    buff, lengths = _varint_encode(values)
+    offsets = numpy.zeros(V + 1, numpy.int64)
+    numpy.cumsum(numpy.bincount(words, lengths, V), out=offsets[1:])
+    return buff, offsets
+
+
+def _varint_encode(values):
+    # encodes non-negative ints 7 bits at a time, low bits first, with the
+    # high bit set on every byte except the last byte of each value
+    values = numpy.asarray(values, numpy.int64)
+    lengths = numpy.ones(len(values), numpy.int64)
+    remaining = values >> 7
+    while remaining.any():
+        lengths += remaining > 0
+        remaining >>= 7
+
+    starts = numpy.cumsum(lengths) - lengths
+    buff = numpy.zeros(lengths.sum(), numpy.uint8)
+    for i in range(lengths.max() if len(values) else 0):
+        mask = lengths > i
+        byte = (values[mask] >> (7 * i)) & 0x7f
+        more = (lengths[mask] > i + 1) * 0x80
+        buff[starts[mask] + i] = byte | more
+    return buff, lengths
+
+
+def _varint_decode(buff):
+    buff = numpy.asarray(buff)
+    ends = numpy.flatnonzero(buff < 0x80)
+    if len(ends) == len(buff):
+        return buff.astype(numpy.int64)
+
+    starts = numpy.concatenate(([0], ends[:-1] + 1))
+    lengths = ends - starts + 1
+    values = numpy.zeros(len(ends), numpy.int64)
+    for i in range(lengths.max()):
+        mask = lengths > i
+        byte = buff[starts[mask] + i] & 0x7f
+        values[mask] |= byte.astype(numpy.int64) << (7 * i)
+    return values
+
+
+def _intersect(small, large):
+    # keeps the values of the sorted array small which are in the sorted
+    # array large, locating each one by binary search
+    found = numpy.searchsorted(large, small)
+    found[found == len(large)] = 0
+    return small[large[found] == small] if len(large) else large
+
+
+class SimilarityIndex(object):
+    """
+    A nearest neighbour index over document vectors under cosine similarity.
+    Exact search scores documents block_size rows at a time with a matrix
+    product, while approximate search only scores the documents sharing a
+    random projection hash bucket with the query in at least one table.
+    """
+
+    block_size = 1024
+
+    def __init__(self, vectors):
+        optional.require('SimilarityIndex')
+
+        vectors = numpy.asarray(vectors, numpy.float64)
+        norms = numpy.sqrt((vectors ** 2).sum(axis=1))
+        norms[norms == 0] = 1
+        self.vectors = vectors / norms[:, numpy.newaxis]
+
+    @classmethod
+    def from_model(cls, model):
+        """
+        SimilarityIndex.from_model(TopicModel): return SimilarityIndex
+        Returns an index of the documents of a trained model. Topic models are
+        represented by their smoothed document topic proportions c_dt + alpha,
+        and cluster models by the posterior over clusters of each document.
+        """
+
+        optional.require('SimilarityIndex')
+
+        if hasattr(model, 'c_dt'):
+            return cls(numpy.asarray(model.c_dt) + model.alpha)
+
+        c_k_doc = numpy.asarray(model.c_k_doc, numpy.float64)
+        c_kv = numpy.asarray(model.c_kv, numpy.float64)
+        c_k_token = numpy.asarray(model.c_k_token, numpy.float64)
+
+        lambda_ = numpy.log(model.gamma + c_k_doc)
+        phi = numpy.log(model.beta + c_kv)
+        phi -= numpy.log(model.Vbeta + c_k_token)[:, numpy.newaxis]
+
+        lposts = data.doc_term_matrix(model.w, model.V) * phi.T + lambda_
+        lposts -= lposts.max(axis=1)[:, numpy.newaxis]
+        return cls(numpy.exp(lposts))
+
+    def top_k(self, k):
+        """
+        SimilarityIndex.top_k(int): return numpy.ndarray
+        Returns an array with a row for each document giving the indices of
+        its k most similar documents, most similar first
+        """
+
+        num_docs = len(self.vectors)
+        k = min(k, num_docs - 1)
+        neighbours = numpy.zeros((num_docs, k), numpy.intp)
+
+        for start in range(0, num_docs, self.block_size):
+            block = numpy.arange(start, min(start + self.block_size, num_docs))
+            sims = numpy.dot(self.vectors[block], self.vectors.T)
+            sims[numpy.arange(len(block)), block] = float('-inf')
+            neighbours[block] = _top_k_rows(sims, k)
+
+        return neighbours
+
+    def approximate_top_k(self, k, bits=12, tables=8):
+        """
+        SimilarityIndex.approximate_top_k(int, int, int): return list of list
+        Returns the indices of approximately the k most similar documents for
+        each document, most similar first. Documents are hashed into buckets
+        by the signs of bits random projections, once for each table, and
+        only documents sharing a bucket are compared. More tables give better
+        recall at the cost of more comparisons, while more bits do the
+        opposite. A document may have fewer than k neighbours.
+        """
+
+        num_docs, dim = self.vectors.shape
+        # proportions all lie in the positive orthant, so hashing them about
+        # their mean spreads them much more evenly over the buckets
+        centered = self.vectors - self.vectors.mean(axis=0)
+
+        buckets = []
+        for _ in range(tables):
+            planes = numpy.random.standard_normal((dim, bits))
+            signs = numpy.dot(centered, planes) > 0
+            keys = signs.dot(1 << numpy.arange(bits))
+            order = numpy.argsort(keys, kind='mergesort')
+            bounds = numpy.flatnonzero(numpy.diff(keys[order])) + 1
+            groups = numpy.split(order, bounds)
+            buckets.append((keys, dict((keys[g[0]], g) for g in groups)))
+
+        neighbours = []
+        for d in range(num_docs):
+            candidates = numpy.unique(numpy.concatenate(
+                [table[keys[d]] for keys, table in buckets]))
+            candidates = candidates[candidates != d]
+            sims = numpy.dot(self.vectors[candidates], self.vectors[d])
+            best = _top_k_rows(sims[numpy.newaxis], min(k, len(candidates)))
+            neighbours.append(candidates[best[0]].tolist())
+        return neighbours
+
+    def xrefs(self, corpus, k=10, approximate=False, **lsh_params):
+        """
+        SimilarityIndex.xrefs(Corpus, int, bool, **int): return XRefSet
+        Returns an XRefSet in which each document refers to its k most
+        similar documents. The vectors must be in the order of the Corpus.
+        Extra keyword arguments are passed to approximate_top_k.
+        """
+
+        if approximate:
+            neighbours = self.approximate_top_k(k, **lsh_params)
+        else:
+            neighbours = self.top_k(k).tolist()
+
+        xrefs = XRefSet(corpus)
+        for refs, neighbours_d in zip(xrefs, neighbours):
+            refs.update(neighbours_d)
+        return xrefs
+
+
+def _top_k_rows(sims, k):
+    # indices of the k largest values in each row, in descending order
+    if k == 0:
+        return numpy.zeros((len(sims), 0), numpy.intp)
+    split = sims.shape[1] - k
+    top = numpy.argpartition(sims, split, axis=1)[:, split:]
+    rows = numpy.arange(len(sims))[:, numpy.newaxis]
+    order = numpy.argsort(-sims[rows, top], axis=1, kind='mergesort')
+    return top[rows, order]
+
+
 def f_measure(xrefs, model):
     """
     f_measure(XRefSet, xrefmodel): return float
@@ -2,10 +2,19 @@
 
 import sys
 import time
+import random
+import cPickle
+import contextlib
+import collections
+from pytopic.util import data
+from pytopic.util.optional import numpy
 
 class TopicModel(object):
     """Base class for a generative model of textual data"""
 
+    # the hyperparameters and sampler state needed to resume inference
+    snapshot_attrs = []
+
     def __init__(self, corpus):
         self.titles = list(corpus.titles)
         self.vocab = list(corpus.vocab)
@@ -15,10 +24,16 @@ class TopicModel(object):
         self.N = [len(doc) for doc in self.w]
         self.V = len(self.vocab)
 
+        self._init_inference()
+
+    def _init_inference(self):
         self._handlers = []
 
         self._inference_algorithm = None
+        self._inference_params = None
         self.num_iters = 0
+        self.num_changes = 0
+        self.phase_times = collections.defaultdict(float)
 
     def sample(self):
         """
@@ -32,7 +47,7 @@ class TopicModel(object):
         Performs inference on the model for the given number of iterations
         """
 
-        self._ensure_inference_set()
+        self._start_inference()
 
         for _ in range(iterations):
             try:
@@ -40,13 +55,15 @@ class TopicModel(object):
             except StopIteration:
                 break
 
+        self._finish_inference()
+
     def timed_inference(self, seconds):
         """
         TopicModel.timed_inference(int): return None
         Performs inference on the model for the given number of seconds
         """
 
-        self._ensure_inference_set()
+        self._start_inference()
 
         end_time = time.time() + seconds
 
@@ -56,6 +73,8 @@ class TopicModel(object):
             except StopIteration:
                 break
 
+        self._finish_inference()
+
     def unlimited_inference(self):
         """
         TopicModel.unlimited_inference(int): return None
@@ -63,7 +82,7 @@ class TopicModel(object):
         exception is raised (perhaps by a handler)
         """
 
-        self._ensure_inference_set()
+        self._start_inference()
 
         while True:
             try:
@@ -71,11 +90,31 @@ class TopicModel(object):
             except StopIteration:
                 break
 
+        self._finish_inference()
+
     def iteration(self):
-        self._inference_algorithm()
+        self.num_changes = 0
+        with self.phase('sampling'):
+            self._inference_algorithm()
         self.num_iters += 1
         for handler in self._handlers:
-            handler.handle(self)
+            with self.phase('handler ' + type(handler).__name__):
+                handler.handle(self)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        TopicModel.phase(str): context manager
+        Adds the time spent in the context to phase_times under the given name.
+        Inference algorithms and handlers can use this to time their own
+        phases, which are reported by the Profiler handler.
+        """
+
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.phase_times[name] += time.time() - start_time
 
     def set_inference(self, algorithm, *params):
         """
@@ -84,12 +123,101 @@ class TopicModel(object):
         only valid algorithms are: gibbs.
         """
 
+        self._close_inference()
         self._inference_algorithm = self.algorithms[algorithm](self, *params)
+        self._inference_params = algorithm, params
 
     def _ensure_inference_set(self):
         if self._inference_algorithm is None:
             self.set_inference(self.default_algorithm)
 
+    def _start_inference(self):
+        self._ensure_inference_set()
+        self.phase_times.clear()
+
+    def _finish_inference(self):
+        self._close_inference()
+        for handler in self._handlers:
+            handler.finish(self)
+
+    def _close_inference(self):
+        # algorithms holding resources such as worker processes release them
+        # through a close attribute, and must reacquire them when next called
+        close = getattr(self._inference_algorithm, 'close', None)
+        if close is not None:
+            close()
+
+    def snapshot(self):
+        """
+        TopicModel.snapshot(): return dict
+        Returns a copy of the hyperparameters and sampler state, along with the
+        inference algorithm and random state, which is enough to resume
+        inference on a model of the same corpus
+        """
+
+        return cPickle.loads(self.snapshot_bytes())
+
+    def snapshot_bytes(self):
+        """
+        TopicModel.snapshot_bytes(): return str
+        Returns a snapshot pickled in binary format. Pickling the state is
+        much faster than deep copying it, and the result can be written out
+        later while inference continues.
+        """
+
+        snapshot = {attr: getattr(self, attr) for attr in self.snapshot_attrs}
+        snapshot['num_iters'] = self.num_iters
+        snapshot['inference'] = self._inference_params
+        snapshot['random_state'] = random.getstate()
+        if numpy is not None:
+            snapshot['numpy_random_state'] = numpy.random.get_state()
+        return cPickle.dumps(snapshot, cPickle.HIGHEST_PROTOCOL)
+
+    def restore(self, snapshot):
+        """
+        TopicModel.restore(dict): return None
+        Restores the model to the state given by a snapshot. For algorithms
+        whose whole state is in the snapshot_attrs, such as 'gibbs', 'ccm'
+        and their numpy versions, inference continues exactly where the
+        snapshot left off. Algorithms with private caches or posteriors,
+        such as 'sparse gibbs', 'alias mh', 'parallel gibbs' and the em
+        variants, rebuild them from the restored counts, so they resume from
+        the same assignments but do not repeat an uninterrupted run.
+        """
+
+        for attr in self.snapshot_attrs:
+            setattr(self, attr, snapshot[attr])
+        self.num_iters = snapshot['num_iters']
+
+        self._close_inference()
+        self._inference_algorithm = None
+        self._inference_params = None
+        if snapshot['inference'] is not None:
+            algorithm, params = snapshot['inference']
+            self.set_inference(algorithm, *params)
+
+        random.setstate(snapshot['random_state'])
+        if numpy is not None and 'numpy_random_state' in snapshot:
+            numpy.random.set_state(snapshot['numpy_random_state'])
+
+    def save_snapshot(self, filename):
+        """
+        TopicModel.save_snapshot(str): return None
+        Atomically writes a snapshot of the model to the given file
+        """
+
+        data.atomic_write(filename, self.snapshot_bytes())
+
+    def load_snapshot(self, filename):
+        """
+        TopicModel.load_snapshot(str): return None
+        Restores the model from a snapshot file written by save_snapshot or
+        a Checkpointer
+        """
+
+        with open(filename, 'rb') as infile:
+            self.restore(cPickle.load(infile))
+
     def print_state(self, verbose=False):
         """
         TopicModel.print_state(bool): return None
@@ -109,3 +237,6 @@ class IterationHandler(object):
         """Called at the conclusion of each iteration"""
 
         raise NotImplementedError()
+
+    def finish(self, model):
+        """Called at the conclusion of each call to inference"""
@@ -6,7 +6,8 @@ import collections
 import math
 import random
 from pytopic.model import basic
-from pytopic.util import compute, data
+from pytopic.util import compute, data, optional
+from pytopic.util.optional import numpy, special
 
 def _gibbs(model, temp, sample_func):
     N = model.N
@@ -24,10 +25,12 @@ def _gibbs(model, temp, sample_func):
             sample_k(d)
 
     def sample_k(d):
-        lcounts = []
-        for j in K:
-            model.set_k(d, j)
-            lcounts.append(lprob_k(d, j))
+        # trying the current cluster last lets set_k see the real change
+        lcounts = [0 for _ in K]
+        k_d = model.k[d]
+        for j in K[k_d + 1:] + K[:k_d + 1]:
+            model.move_k(d, j)
+            lcounts[j] = lprob_k(d, j)
         model.set_k(d, sample_func(lcounts))
 
     def compute_lprob_k(d, j):
@@ -75,12 +78,114 @@ def ccm(model):
     return _gibbs(model, 1, compute.argmax)
 
 
-def annealed_em(model, temp):
+def _numpy_counters(model):
+    optional.require('numpy inference', scipy=True)
+
+    # numpy arrays index just like the nested lists, so set_k and the pure
+    # python algorithms continue to work on the converted counters
+    model.c_k_doc = numpy.array(model.c_k_doc, numpy.int32)
+    model.c_k_token = numpy.array(model.c_k_token, numpy.int32)
+    model.c_kv = numpy.array(model.c_kv, numpy.int32, order='F')
+
+
+def _numpy_gibbs(model, temp, sample_func):
+    _numpy_counters(model)
+
+    c_dv = data.doc_term_matrix(model.w, model.V)
+    gamma = model.gamma
+    N = model.N
+    k = model.k
+    c_k_doc = model.c_k_doc
+    c_k_token = model.c_k_token
+    c_kv = model.c_kv
+
+    # lgamma lookup tables indexed by integer count
+    word_totals = numpy.asarray(c_dv.sum(axis=0)).ravel()
+    max_count = word_totals.max() if model.V else 0
+    lgamma_beta = special.gammaln(model.beta + numpy.arange(max_count + 1))
+    lgamma_Vbeta = special.gammaln(model.Vbeta + numpy.arange(sum(N) + 1))
+
+    def sample_model():
+        changes = 0
+        randoms = numpy.random.random_sample(model.M)
+        for d in range(model.M):
+            words = c_dv.indices[c_dv.indptr[d]:c_dv.indptr[d + 1]]
+            counts = c_dv.data[c_dv.indptr[d]:c_dv.indptr[d + 1]]
+
+            k_d = k[d]
+            c_k_doc[k_d] -= 1
+            c_k_token[k_d] -= N[d]
+            c_kv[k_d, words] -= counts
+
+            c_kw = c_kv[:, words]
+            lprobs = numpy.log(gamma + c_k_doc)
+            lprobs += lgamma_beta[c_kw + counts].sum(axis=1)
+            lprobs -= lgamma_beta[c_kw].sum(axis=1)
+            lprobs += lgamma_Vbeta[c_k_token]
+            lprobs -= lgamma_Vbeta[c_k_token + N[d]]
+            if temp != 1:
+                lprobs /= temp
+
+            k_d = sample_func(lprobs, randoms[d])
+            if k_d != k[d]:
+                changes += 1
+                update_lstats(k[d], k_d, words, counts)
+            k[d] = k_d
+            c_k_doc[k_d] += 1
+            c_k_token[k_d] += N[d]
+            c_kv[k_d, words] += counts
+
+        model.num_changes += changes
+
+    def update_lstats(old_k, new_k, words, counts):
+        # called while the document is removed from the counters
+        c_old = c_kv[old_k, words]
+        c_new = c_kv[new_k, words]
+        model.lstat_k[old_k] += numpy.sum(xlogb(c_old) - xlogb(c_old + counts))
+        model.lstat_k[new_k] += numpy.sum(xlogb(c_new + counts) - xlogb(c_new))
+
+    def xlogb(counts):
+        return counts * numpy.log(model.beta + counts)
+
+    return sample_model
+
+
+def _numpy_argmax(lcounts, _):
+    return int(lcounts.argmax())
+
+
+def numpy_gibbs(model):
     """
-    annealed_em(MixtureMultinomial, float): func
-    Creates an annealed em inference algorithm for mixture of multinomials
+    numpy_gibbs(MixtureMultinomial): func
+    Creates a Gibbs sampler for the mixture of multinomials model which scores
+    every cluster for a document in a single vectorized pass over a sparse
+    doc-term matrix, using lgamma lookup tables
+    """
+
+    return _numpy_gibbs(model, 1, compute.numpy_sample_lcounts)
+
+
+def annealed_numpy_gibbs(model, temp):
+    """
+    annealed_numpy_gibbs(MixtureMultinomial, float): func
+    Creates an annealed numpy Gibbs sampler for the Mixture of Multinomials
+    model
+    """
+
+    return _numpy_gibbs(model, temp, compute.numpy_sample_lcounts)
+
+
+def numpy_ccm(model):
+    """
+    numpy_ccm(MixtureMultinomial): func
+    Returns a numpy complete conditional maximization algorithm for the
+    Mixture of Multinomials model
     """
 
+    return _numpy_gibbs(model, 1, _numpy_argmax)
+
+
+def _python_annealed_em(model, temp):
     M = range(model.M)
     K = range(model.K)
     V = range(model.V)
@@ -142,14 +247,30 @@ def annealed_em(model, temp):
     posteriors = init_posteriors()
 
     def em_iteration():
-        lambda_ = calc_lambda()
-        phi = calc_phi()
-        posteriors[:] = update_posteriors(lambda_, phi)
-        update_model()
+        with model.phase('m step'):
+            lambda_ = calc_lambda()
+            phi = calc_phi()
+        with model.phase('e step'):
+            posteriors[:] = update_posteriors(lambda_, phi)
+        with model.phase('update model'):
+            update_model()
 
     return em_iteration
 
 
+def annealed_em(model, temp):
+    """
+    annealed_em(MixtureMultinomial, float): func
+    Creates an annealed em inference algorithm for mixture of multinomials,
+    which uses the matrix form of annealed_numpy_em when numpy is available
+    and falls back to pure python otherwise (e.g. under PyPy)
+    """
+
+    if optional.available(scipy=True):
+        return annealed_numpy_em(model, temp)
+    return _python_annealed_em(model, temp)
+
+
 def em(model):
     """
     em(MixtureMultinomial): func
@@ -159,13 +280,7 @@ def em(model):
     return annealed_em(model, 1)
 
 
-def annealed_vem(model, temp):
-    """
-    annealed_vem(MixtureMultinomial): func
-    Creates an annealed variational em inference algorithm for the mixture of
-    multinomials model
-    """
-
+def _python_annealed_vem(model, temp):
     gamma = model.gamma
     beta = model.beta
 
@@ -248,14 +363,30 @@ def annealed_vem(model, temp):
     theta = init_theta()
 
     def vem_iteration():
-        a = calc_a()
-        b = calc_b()
-        theta[:] = update_theta(a, b)
-        update_model()
+        with model.phase('m step'):
+            a = calc_a()
+            b = calc_b()
+        with model.phase('e step'):
+            theta[:] = update_theta(a, b)
+        with model.phase('update model'):
+            update_model()
 
     return vem_iteration
 
 
+def annealed_vem(model, temp):
+    """
+    annealed_vem(MixtureMultinomial, float): func
+    Creates an annealed variational em inference algorithm for the mixture of
+    multinomials model, which uses the matrix form of annealed_numpy_vem when
+    numpy is available and falls back to pure python otherwise
+    """
+
+    if optional.available(scipy=True):
+        return annealed_numpy_vem(model, temp)
+    return _python_annealed_vem(model, temp)
+
+
 def vem(model):
     """
     vem(MixtureMultinomial): func
@@ -266,17 +397,155 @@ def vem(model):
     return annealed_vem(model, 1)
 
 
+def _numpy_init_params(model):
+    lambda_ = numpy.log(1 + model.c_k_doc)
+    compute.numpy_lnormalize(lambda_)
+
+    phi = numpy.log(1 + model.c_kv)
+    compute.numpy_lnormalize(phi)
+
+    return lambda_, phi
+
+
+def _numpy_update_model(model, lposteriors):
+    for d, k_d in enumerate(lposteriors.argmax(axis=1).tolist()):
+        if model.k[d] != k_d:
+            model.set_k(d, k_d)
+
+
+def annealed_numpy_em(model, temp):
+    """
+    annealed_numpy_em(MixtureMultinomial, float): func
+    Creates an annealed em inference algorithm for mixture of multinomials,
+    which computes the E and M steps as products of the sparse doc-term matrix
+    with the log parameter matrices
+    """
+
+    _numpy_counters(model)
+    w = data.doc_term_matrix(model.w, model.V)
+
+    def update_posteriors(lambda_, phi):
+        posteriors = w.dot(phi.T) + lambda_
+        if temp != 1:
+            posteriors /= temp
+        compute.numpy_lnormalize(posteriors)
+        return posteriors
+
+    def calc_lambda():
+        lambda_ = compute.numpy_lsum(posteriors, 0)[0]
+        compute.numpy_lnormalize(lambda_)
+        return lambda_
+
+    def calc_phi():
+        phi = numpy.log1p(w.T.dot(numpy.exp(posteriors)).T)
+        compute.numpy_lnormalize(phi)
+        return phi
+
+    posteriors = update_posteriors(*_numpy_init_params(model))
+
+    def em_iteration():
+        with model.phase('m step'):
+            lambda_ = calc_lambda()
+            phi = calc_phi()
+        with model.phase('e step'):
+            posteriors[:] = update_posteriors(lambda_, phi)
+        with model.phase('update model'):
+            _numpy_update_model(model, posteriors)
+
+    return em_iteration
+
+
+def numpy_em(model):
+    """
+    numpy_em(MixtureMultinomial): func
+    Creates a numpy em inference algorithm for the mixture of multinomials
+    model
+    """
+
+    return annealed_numpy_em(model, 1)
+
+
+def annealed_numpy_vem(model, temp):
+    """
+    annealed_numpy_vem(MixtureMultinomial, float): func
+    Creates an annealed variational em inference algorithm for the mixture of
+    multinomials model, which computes the updates as products of the sparse
+    doc-term matrix with the parameter matrices
+    """
+
+    _numpy_counters(model)
+    w = data.doc_term_matrix(model.w, model.V)
+
+    def init_theta():
+        lambda_, phi = _numpy_init_params(model)
+        theta = w.dot(phi.T) + lambda_
+        compute.numpy_lnormalize(theta)
+        return theta
+
+    def update_theta(a, b):
+        dig_a = special.psi(a) - special.psi(a.sum())
+        dig_b = special.psi(b) - special.psi(b.sum(axis=1, keepdims=True))
+        theta = w.dot(dig_b.T) + dig_a
+        if temp != 1:
+            theta /= temp
+        compute.numpy_lnormalize(theta)
+        return theta
+
+    def calc_a(resp):
+        a = model.gamma + resp.sum(axis=0)
+        a /= a.sum()
+        return a
+
+    def calc_b(resp):
+        b = model.beta + w.T.dot(resp).T
+        b /= b.sum(axis=1, keepdims=True)
+        return b
+
+    theta = init_theta()
+
+    def vem_iteration():
+        with model.phase('m step'):
+            resp = numpy.exp(theta)
+            a = calc_a(resp)
+            b = calc_b(resp)
+        with model.phase('e step'):
+            theta[:] = update_theta(a, b)
+        with model.phase('update model'):
+            _numpy_update_model(model, theta)
+
+    return vem_iteration
+
+
+def numpy_vem(model):
+    """
+    numpy_vem(MixtureMultinomial): func
+    Creates a numpy variational em inference algorithm for the mixture of
+    multinomials model
+    """
+
+    return annealed_numpy_vem(model, 1)
+
+
 class MixtureMultinomial(basic.TopicModel):
     """Implementation of Mixture of Multinomials model"""
 
     algorithms = {'gibbs': gibbs,
                   'annealed gibbs': annealed_gibbs,
                   'ccm': ccm,
+                  'numpy gibbs': numpy_gibbs,
+                  'annealed numpy gibbs': annealed_numpy_gibbs,
+                  'numpy ccm': numpy_ccm,
                   'em': em,
                   'annealed em': annealed_em,
                   'vem': vem,
-                  'annealed vem': annealed_vem}
+                  'annealed vem': annealed_vem,
+                  'numpy em': numpy_em,
+                  'annealed numpy em': annealed_numpy_em,
+                  'numpy vem': numpy_vem,
+                  'annealed numpy vem': annealed_numpy_vem}
     default_algorithm = 'ccm'
+    snapshot_attrs = ['K', 'gamma', 'beta', 'Vbeta',
+                      'k', 'c_k_doc', 'c_kv', 'c_k_token', 'lstat_k']
 
     def __init__(self, corpus, K, gamma, beta):
         basic.TopicModel.__init__(self, corpus)
@@ -303,11 +572,29 @@ class MixtureMultinomial(basic.TopicModel):
                 self.c_kv[self.k[d]][w] += 1
                 self.c_dv[d][w] += 1
 
+        self.lstat_k = [self._compute_lstat(k) for k in range(self.K)]
+
     def set_k(self, d, k_d):
         """
         MixtureMultinomial.set_k(int, int): return None
         Updates the value k_d along with all counters. This method also adjust
-        the counters related to the previous value of k_d
+        the counters related to the previous value of k_d. Changed assignments
+        are counted in num_changes.
+        """
+
+        old_k = self.k[d]
+        self.move_k(d, k_d)
+        if old_k != k_d:
+            self.num_changes += 1
+            self._update_lstats(d, old_k, k_d)
+
+    def move_k(self, d, k_d):
+        """
+        MixtureMultinomial.move_k(int, int): return None
+        Updates the value k_d along with all counters like set_k, but without
+        counting the change. Used to try out assignments during sampling. The
+        likelihood statistics are not updated, so the document must be moved
+        back before the next call to set_k or likelihood.
         """
 
         self.c_k_doc[self.k[d]] -= 1
@@ -322,6 +609,23 @@ class MixtureMultinomial(basic.TopicModel):
         for w in self.w[d]:
             self.c_kv[self.k[d]][w] += 1
 
+    def _compute_lstat(self, k):
+        return sum(self._xlogb(c) for c in self.c_kv[k] if c)
+
+    def _update_lstats(self, d, old_k, new_k):
+        # called once the counters reflect the move of d from old_k to new_k
+        for v, c_dv in self.c_dv[d].iteritems():
+            c_old = self.c_kv[old_k][v]
+            c_new = self.c_kv[new_k][v]
+            self.lstat_k[old_k] += self._xlogb(c_old)
+            self.lstat_k[old_k] -= self._xlogb(c_old + c_dv)
+            self.lstat_k[new_k] += self._xlogb(c_new)
+            self.lstat_k[new_k] -= self._xlogb(c_new - c_dv)
+
+    def _xlogb(self, count):
+        # lstat_k[k] is the sum of c log(beta + c) over the word counts of k
+        return count * math.log(self.beta + count)
+
     def cluster_words(self, k, n):
         """
         MixtureMultinomial.cluster_topics(int, int): return list of int
@@ -373,20 +677,17 @@ class MixtureMultinomial(basic.TopicModel):
         MixtureMultinomial.likelihood(): float
         Computes the unnormalized log likelihood of the data, which gives an
         indication as to how strongly the model represents the training data.
+        The word counts enter only through the per-cluster statistics lstat_k,
+        which set_k keeps up to date, so this takes O(K) time.
         """
 
-        K = range(self.K)
-        V = range(self.V)
-
-        lambda_ = [math.log(self.gamma + self.c_k_doc[k]) for k in K]
-        compute.lnormalize(lambda_)
-
-        phi = [[math.log(self.beta + self.c_kv[k][v]) for v in V] for k in K]
-        for phi_k in phi:
-            compute.lnormalize(phi_k)
+        lnorm = math.log(self.K * self.gamma + self.M)
 
         like = 0
-        for d, k_d in enumerate(self.k):
-            like += lambda_[k_d]
-            like += sum(self.c_dv[d][v] * phi[k_d][v] for v in self.c_dv[d])
+        for k in range(self.K):
+            c_k_doc = self.c_k_doc[k]
+            c_k_token = self.c_k_token[k]
+            like += c_k_doc * (math.log(self.gamma + c_k_doc) - lnorm)
+            like += self.lstat_k[k]
+            like -= c_k_token * math.log(self.Vbeta + c_k_token)
         return like
@@ -0,0 +1,127 @@
+"""Implements online variational Bayes for LDA, for streamed corpora"""
+
+from __future__ import division
+
+import itertools
+from pytopic.model import basic
+from pytopic.util import optional
+from pytopic.util.optional import numpy, special
+
+def _dirichlet_expectation(params):
+    if params.ndim == 1:
+        return special.psi(params) - special.psi(params.sum())
+    return special.psi(params) - special.psi(params.sum(axis=1))[:, None]
+
+
+def online_vb(model):
+    """
+    online_vb(OnlineLDA): func
+    Creates a stochastic variational inference algorithm which updates the
+    topics from one minibatch of the document stream per iteration
+    """
+
+    alpha = model.alpha
+
+    def minibatches():
+        while True:
+            docs = iter(model.docs)
+            batch = list(itertools.islice(docs, model.batch_size))
+            if not batch:
+                raise ValueError('docs yielded no minibatch')
+            while batch:
+                yield batch
+                batch = list(itertools.islice(docs, model.batch_size))
+
+    stream = minibatches()
+
+    def e_step(batch, exp_lbeta):
+        sstats = numpy.zeros_like(model.lambda_)
+        for doc in batch:
+            words = numpy.array(sorted(set(doc)), numpy.int64)
+            counts = numpy.bincount(doc, minlength=model.V)[words]
+
+            gamma_d = numpy.ones(model.T)
+            exp_ltheta_d = numpy.exp(_dirichlet_expectation(gamma_d))
+            exp_lbeta_d = exp_lbeta[:, words]
+            norm_d = exp_ltheta_d.dot(exp_lbeta_d) + 1e-100
+
+            for _ in range(model.max_doc_iters):
+                last_gamma = gamma_d
+                gamma_d = alpha + exp_ltheta_d * (counts / norm_d).dot(
+                    exp_lbeta_d.T)
+                exp_ltheta_d = numpy.exp(_dirichlet_expectation(gamma_d))
+                norm_d = exp_ltheta_d.dot(exp_lbeta_d) + 1e-100
+                if numpy.abs(gamma_d - last_gamma).mean() < model.doc_thresh:
+                    break
+
+            sstats[:, words] += numpy.outer(exp_ltheta_d, counts / norm_d)
+        return sstats * exp_lbeta
+
+    def update():
+        with model.phase('read minibatch'):
+            batch = next(stream)
+        with model.phase('e step'):
+            exp_lbeta = numpy.exp(_dirichlet_expectation(model.lambda_))
+            sstats = e_step(batch, exp_lbeta)
+
+        with model.phase('m step'):
+            rho = (model.tau0 + model.num_iters) ** -model.kappa
+            model.lambda_ *= 1 - rho
+            model.lambda_ += rho * (model.eta + model.D / len(batch) * sstats)
+
+    return update
+
+
+class OnlineLDA(basic.TopicModel):
+    """
+    Latent Dirichlet Allocation with online variational Bayes. The documents
+    are streamed in minibatches, so that memory is bounded by the T x V topic
+    parameters plus a minibatch rather than by the corpus. The docs can be any
+    reiterable of token type lists using the given vocab, such as a
+    CompactCorpus or a CorpusStream. D is the total number of documents,
+    which defaults to the length of docs. Inference raises ValueError if a
+    pass over the docs yields no documents.
+    """
+
+    algorithms = {'online vb': online_vb}
+    default_algorithm = 'online vb'
+    snapshot_attrs = ['T', 'alpha', 'eta', 'D', 'batch_size',
+                      'tau0', 'kappa', 'lambda_']
+
+    max_doc_iters = 100
+    doc_thresh = .001
+
+    def __init__(self, docs, vocab, T, alpha, eta, D=None, batch_size=256,
+                 tau0=1024, kappa=.7):
+        optional.require('OnlineLDA', scipy=True)
+
+        self.docs = docs
+        self.vocab = list(vocab)
+        self.V = len(self.vocab)
+        self._init_inference()
+
+        self.T = T
+        self.alpha = alpha
+        self.eta = eta
+        self.D = len(docs) if D is None else D
+        self.batch_size = batch_size
+        self.tau0 = tau0
+        self.kappa = kappa
+
+        self.lambda_ = numpy.random.gamma(100, .01, (self.T, self.V))
+
+    def topic_words(self, t, n):
+        """
+        OnlineLDA.topic_words(int, int): return list of int
+        Returns the top n words in topic t
+        """
+
+        return numpy.argsort(-self.lambda_[t])[:n].tolist()
+
+    def print_state(self, verbose=False):
+        for t in range(self.T):
+            print '{0} -'.format(t),
+            for v in self.topic_words(t, 15):
+                print self.vocab[v],
+            print
+        print
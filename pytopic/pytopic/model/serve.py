@@ -0,0 +1,189 @@
+"""Answers topic and cluster requests on new raw text with frozen models"""
+
+from __future__ import division
+
+import sys
+import select
+import cPickle
+import StringIO
+from pytopic.pipeline import dataset
+from pytopic.util import data, optional
+from pytopic.util.optional import numpy, sparse
+
+class Server(object):
+    """
+    Base class for serving a frozen model. Requests are raw text documents,
+    tokenized with the given Tokenizer and converted using the vocabulary of
+    the model. Subclasses precompute their tables from a model snapshot.
+    """
+
+    def __init__(self, vocab, tokenizer=None):
+        optional.require('serving', scipy=True)
+
+        self.types = {token: v for v, token in enumerate(vocab)}
+        self.V = len(self.types)
+        if tokenizer is None:
+            tokenizer = dataset.Tokenizer()
+        self.tokenizer = tokenizer
+
+    @classmethod
+    def from_model(cls, model, tokenizer=None):
+        """
+        Server.from_model(TopicModel, Tokenizer): Server
+        Returns a Server for the current state of a trained model
+        """
+
+        return cls(model.vocab, model.snapshot(), tokenizer)
+
+    @classmethod
+    def from_snapshot(cls, filename, vocab, tokenizer=None):
+        """
+        Server.from_snapshot(str, iterable of str, Tokenizer): Server
+        Returns a Server for a model snapshot file, such as those written by a
+        Checkpointer, using the vocab of the corpus the model was trained on
+        """
+
+        with open(filename, 'rb') as infile:
+            return cls(vocab, cPickle.load(infile), tokenizer)
+
+    def convert(self, text):
+        """
+        Server.convert(str): list of int
+        Tokenizes the raw text into token types, dropping unknown tokens
+        """
+
+        doc = []
+        buff = StringIO.StringIO(text)
+        for _, tokens in self.tokenizer.tokenize('', buff):
+            doc.extend(self.types[token] for token in tokens
+                       if token in self.types)
+        return doc
+
+    def respond(self, texts):
+        """
+        Server.respond(list of str): list of str
+        Answers a micro-batch of requests, returning one response per text
+        """
+
+        docs = [self.convert(text) for text in texts]
+        return self.infer(data.doc_term_matrix(docs, self.V))
+
+    def infer(self, counts):
+        """
+        Server.infer(csr_matrix): list of str
+        Returns a response for each row of a doc-term count matrix
+        """
+
+        raise NotImplementedError()
+
+    def serve(self, infile=sys.stdin, outfile=sys.stdout, batch_size=64):
+        """
+        Server.serve(file, file, int): None
+        Treats each line of the input as a request, and writes one response
+        line per request. Requests which are already waiting are answered
+        together in micro-batches of up to batch_size lines. Inputs without a
+        file descriptor, such as StringIO, are answered one line at a time.
+        """
+
+        while True:
+            line = infile.readline()
+            if not line:
+                return
+
+            lines = [line]
+            while len(lines) < batch_size and _ready(infile):
+                line = infile.readline()
+                if not line:
+                    break
+                lines.append(line)
+
+            for response in self.respond(lines):
+                print >> outfile, response
+            outfile.flush()
+
+            if not line:
+                return
+
+
+def _ready(infile):
+    try:
+        infile.fileno()
+    except (AttributeError, IOError, ValueError):
+        return False
+    return bool(select.select([infile], [], [], 0)[0])
+
+
+class TopicServer(Server):
+    """
+    Serves the topic proportions of new documents using the frozen topics of a
+    VanillaLDA model. Each response lists the top topics as topic:proportion.
+    """
+
+    iterations = 20
+    top_n = 5
+
+    def __init__(self, vocab, snapshot, tokenizer=None):
+        Server.__init__(self, vocab, tokenizer)
+
+        self.alpha = snapshot['alpha']
+        self.phi = snapshot['beta'] + numpy.array(snapshot['c_tv'], float)
+        self.phi /= self.phi.sum(axis=1)[:, numpy.newaxis]
+
+    def doc_topics(self, counts):
+        """
+        TopicServer.doc_topics(csr_matrix): array of float
+        Returns the topic proportions of each row of the doc-term matrix,
+        computed with fixed point iterations against the frozen topics
+        """
+
+        rows = numpy.repeat(numpy.arange(counts.shape[0]),
+                            numpy.diff(counts.indptr))
+        phi_nz = self.phi[:, counts.indices].T
+
+        theta = numpy.ones((counts.shape[0], self.phi.shape[0]))
+        theta /= self.phi.shape[0]
+        for _ in range(self.iterations):
+            denom = (theta[rows] * phi_nz).sum(axis=1)
+            weights = sparse.csr_matrix((counts.data / denom, counts.indices,
+                                         counts.indptr), counts.shape)
+            theta *= weights.dot(self.phi.T)
+            theta += self.alpha
+            theta /= theta.sum(axis=1)[:, numpy.newaxis]
+        return theta
+
+    def infer(self, counts):
+        responses = []
+        for theta_d in self.doc_topics(counts):
+            top = numpy.argsort(-theta_d)[:self.top_n]
+            responses.append(' '.join('{0}:{1:.4f}'.format(t, theta_d[t])
+                                      for t in top))
+        return responses
+
+
+class ClusterServer(Server):
+    """
+    Serves cluster assignments for new documents using the frozen clusters of
+    a MixtureMultinomial model
+    """
+
+    def __init__(self, vocab, snapshot, tokenizer=None):
+        Server.__init__(self, vocab, tokenizer)
+
+        self.llambda = numpy.log(snapshot['gamma'] +
+                                 numpy.array(snapshot['c_k_doc'], float))
+        self.llambda -= numpy.log(numpy.exp(self.llambda).sum())
+
+        self.lphi = numpy.log(snapshot['beta'] +
+                              numpy.array(snapshot['c_kv'], float))
+        self.lphi -= numpy.log(numpy.exp(self.lphi).sum(axis=1))[:, None]
+
+    def clusters(self, counts):
+        """
+        ClusterServer.clusters(csr_matrix): array of int
+        Returns the most probable cluster for each row of the doc-term matrix
+        """
+
+        return (counts.dot(self.lphi.T) + self.llambda).argmax(axis=1)
+
+    def infer(self, counts):
+        return [str(k) for k in self.clusters(counts)]
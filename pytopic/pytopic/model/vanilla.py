@@ -1,9 +1,15 @@
 from __future__ import division
 
+import cPickle
+import itertools
+import math
+import multiprocessing
+import random
 from pytopic.model import basic
-from pytopic.util import compute, data
+from pytopic.util import compute, data, optional, parallel
+from pytopic.util.optional import numpy
 
-def _gibbs(model, temp, sample_func):
+def _gibbs(model, temp, sample_func, docs=None):
     alpha = model.alpha
     beta = model.beta
     Vbeta = model.beta
@@ -11,9 +17,10 @@ def _gibbs(model, temp, sample_func):
     c_dt = model.c_dt
     c_tv = model.c_tv
     c_t = model.c_t
+    docs = range(model.M) if docs is None else docs
 
     def sample_model():
-        for d in range(model.M):
+        for d in docs:
             for n in range(model.N[d]):
                 sample_z(d, n)
 
@@ -49,13 +56,460 @@ def ccm(model):
     return _gibbs(model, 1, compute.argmax)
 
 
+def _parallel_worker(model, docs, conn):
+    parallel.reseed()
+    sample_docs = _gibbs(model, 1, compute.sample_counts, docs)
+    delta = {}
+
+    while True:
+        total = cPickle.loads(conn.recv_bytes())
+        if total is None:
+            break
+
+        # the merged deltas include the changes this worker already applied
+        for (t, v), count in total.iteritems():
+            count -= delta.get((t, v), 0)
+            if count:
+                model.c_tv[t][v] += count
+                model.c_t[t] += count
+
+        last_state = [list(model.z[d]) for d in docs]
+        sample_docs()
+
+        changes = []
+        delta = {}
+        for d, z_d in zip(docs, last_state):
+            for n, z_dn in enumerate(model.z[d]):
+                if z_d[n] != z_dn:
+                    changes.append((d, n, z_dn))
+                    w_dn = model.w[d][n]
+                    delta[z_d[n], w_dn] = delta.get((z_d[n], w_dn), 0) - 1
+                    delta[z_dn, w_dn] = delta.get((z_dn, w_dn), 0) + 1
+        conn.send((changes, delta))
+
+
+def parallel_gibbs(model, processes=None):
+    """
+    parallel_gibbs(VanillaLDA, int): func
+    Creates an approximate distributed (AD-LDA) Gibbs sampler. The documents
+    are partitioned across a pool of worker processes, each of which samples
+    its documents against a local copy of the counters. After each iteration
+    the topic word count deltas of the workers are summed, applied to the
+    model and sent to every worker, while the changed assignments only update
+    the model. By default one process per cpu is used. The workers are forked
+    from the current model when a sweep needs them and shut down at the end of
+    each call to inference.
+    """
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    workers = []
+    pending = []
+
+    def start():
+        for i in range(processes):
+            conn, worker_conn = multiprocessing.Pipe()
+            docs = range(i, model.M, processes)
+            worker = multiprocessing.Process(target=_parallel_worker,
+                                             args=(model, docs, worker_conn))
+            worker.daemon = True
+            worker.start()
+            workers.append((worker, conn))
+        pending[:] = [cPickle.dumps({}, cPickle.HIGHEST_PROTOCOL)]
+
+    def sample_model():
+        if not workers:
+            start()
+
+        with model.phase('parallel sweep'):
+            for _, conn in workers:
+                conn.send_bytes(pending[0])
+            results = [conn.recv() for _, conn in workers]
+
+        with model.phase('merge'):
+            total = {}
+            for changes, delta in results:
+                for d, n, z_dn in changes:
+                    z_old = model.z[d][n]
+                    model.c_dt[d][z_old] -= 1
+                    model.c_dt[d][z_dn] += 1
+                    model.z[d][n] = z_dn
+                model.num_changes += len(changes)
+
+                for key, count in delta.iteritems():
+                    total[key] = total.get(key, 0) + count
+
+            for (t, v), count in total.iteritems():
+                model.c_tv[t][v] += count
+                model.c_t[t] += count
+            pending[0] = cPickle.dumps(total, cPickle.HIGHEST_PROTOCOL)
+
+    def close():
+        stop = cPickle.dumps(None, cPickle.HIGHEST_PROTOCOL)
+        for worker, conn in workers:
+            conn.send_bytes(stop)
+            worker.join()
+            conn.close()
+        del workers[:]
+
+    sample_model.close = close
+    return sample_model
+
+
+def sparse_gibbs(model):
+    """
+    sparse_gibbs(VanillaLDA): func
+    Creates a SparseLDA Gibbs sampler, which splits the full conditional into
+    smoothing, document-topic and topic-word buckets so that the cost of each
+    token scales with the number of nonzero topics rather than with T
+    """
+
+    alpha = model.alpha
+    beta = model.beta
+    Vbeta = model.Vbeta
+    T = range(model.T)
+    w = model.w
+    z = model.z
+    c_t = model.c_t
+    c_dt = model.c_dt
+    c_tv = model.c_tv
+
+    doc_topics = [set(z_d) for z_d in z]
+    word_topics = [set() for _ in range(model.V)]
+    for w_d, z_d in zip(w, z):
+        for w_dn, z_dn in zip(w_d, z_d):
+            word_topics[w_dn].add(z_dn)
+
+    denom = [Vbeta + c_t[j] for j in T]
+    coef = [alpha / denom[j] for j in T]
+
+    def sample_model():
+        smooth = sum(alpha * beta / denom[j] for j in T)
+        for d in range(model.M):
+            smooth = sample_doc(d, smooth)
+
+    def sample_doc(d, smooth):
+        c_d = c_dt[d]
+        topics_d = doc_topics[d]
+
+        for j in topics_d:
+            coef[j] = (alpha + c_d[j]) / denom[j]
+        doc_mass = sum(beta * c_d[j] / denom[j] for j in topics_d)
+
+        for n in range(model.N[d]):
+            w_dn = w[d][n]
+            j = z[d][n]
+
+            smooth -= alpha * beta / denom[j]
+            doc_mass -= beta * c_d[j] / denom[j]
+            model.unset_z(d, n)
+            if c_d[j] == 0:
+                topics_d.discard(j)
+            if c_tv[j][w_dn] == 0:
+                word_topics[w_dn].discard(j)
+            update_topic(c_d, j)
+            smooth += alpha * beta / denom[j]
+            doc_mass += beta * c_d[j] / denom[j]
+
+            word_probs = [(k, coef[k] * c_tv[k][w_dn])
+                          for k in word_topics[w_dn]]
+            word_mass = sum(prob for _, prob in word_probs)
+
+            sample = random.uniform(0, smooth + doc_mass + word_mass)
+            if sample < word_mass:
+                j = _sample_bucket(word_probs, sample)
+            elif sample < word_mass + doc_mass:
+                sample -= word_mass
+                j = _sample_bucket(((k, beta * c_d[k] / denom[k])
+                                    for k in topics_d), sample)
+            else:
+                sample -= word_mass + doc_mass
+                j = _sample_bucket(((k, alpha * beta / denom[k])
+                                    for k in T), sample)
+
+            smooth -= alpha * beta / denom[j]
+            doc_mass -= beta * c_d[j] / denom[j]
+            model.set_z(d, n, j)
+            topics_d.add(j)
+            word_topics[w_dn].add(j)
+            update_topic(c_d, j)
+            smooth += alpha * beta / denom[j]
+            doc_mass += beta * c_d[j] / denom[j]
+
+        for j in topics_d:
+            coef[j] = alpha / denom[j]
+        return smooth
+
+    def update_topic(c_d, j):
+        denom[j] = Vbeta + c_t[j]
+        coef[j] = (alpha + c_d[j]) / denom[j]
+
+    return sample_model
+
+
+def _sample_bucket(probs, sample):
+    for key, prob in probs:
+        if sample < prob:
+            return key
+        sample -= prob
+    return key # only reachable through floating point rounding
+
+
+def alias_mh(model, mh_steps=2, refresh_interval=4):
+    """
+    alias_mh(VanillaLDA, int, int): func
+    Creates a LightLDA style Metropolis-Hastings sampler for LDA, which
+    alternates between document and word proposals so that each topic draw
+    costs amortized constant time. The word proposals come from per-word alias
+    tables which are lazily rebuilt once they are refresh_interval iterations
+    old. The acceptance rate of the last iteration is stored on the model.
+    """
+
+    alpha = model.alpha
+    beta = model.beta
+    Vbeta = model.Vbeta
+    Talpha = model.T * alpha
+    w = model.w
+    z = model.z
+    c_t = model.c_t
+    c_dt = model.c_dt
+    c_tv = model.c_tv
+
+    tables = [None for _ in range(model.V)]
+    built = [0 for _ in range(model.V)]
+
+    def sample_model():
+        accepted = 0
+        for d in range(model.M):
+            for n in range(model.N[d]):
+                accepted += sample_z(d, n)
+        proposed = 2 * mh_steps * sum(model.N)
+        model.acceptance_rate = accepted / proposed if proposed else 0
+
+    def sample_z(d, n):
+        w_dn = w[d][n]
+        j = z[d][n]
+        model.unset_z(d, n)
+
+        accepted = 0
+        weights, table = word_proposal(w_dn)
+        for _ in range(mh_steps):
+            k = doc_proposal(d, n)
+            ratio = word_prob(w_dn, k) / word_prob(w_dn, j)
+            if random.random() < ratio:
+                j = k
+                accepted += 1
+
+            k = compute.sample_alias(table)
+            ratio = prob_z(d, w_dn, k) * weights[j]
+            ratio /= prob_z(d, w_dn, j) * weights[k]
+            if random.random() < ratio:
+                j = k
+                accepted += 1
+
+        model.set_z(d, n, j)
+        return accepted
+
+    def word_proposal(v):
+        if tables[v] is None or model.num_iters - built[v] >= refresh_interval:
+            weights = [word_prob(v, j) for j in range(model.T)]
+            tables[v] = weights, compute.alias_table(weights)
+            built[v] = model.num_iters
+        return tables[v]
+
+    def doc_proposal(d, n):
+        # proportional to alpha + c_dt[d] by picking the topic of another
+        # token in the document, or a uniform topic for the alpha mass
+        others = model.N[d] - 1
+        sample = random.uniform(0, others + Talpha)
+        if sample < others:
+            m = int(sample)
+            return z[d][m + 1 if m >= n else m]
+        return compute.sample_uniform(model.T)
+
+    def word_prob(v, j):
+        return (beta + c_tv[j][v]) / (Vbeta + c_t[j])
+
+    def prob_z(d, v, j):
+        return (alpha + c_dt[d][j]) * word_prob(v, j)
+
+    return sample_model
+
+
+def _numpy_flatten(model):
+    optional.require('the numpy samplers')
+
+    offsets = numpy.cumsum([0] + model.N)
+    tokens = offsets[-1]
+
+    w = numpy.fromiter(itertools.chain(*model.w), numpy.int32, tokens)
+    d = numpy.repeat(numpy.arange(model.M, dtype=numpy.int32), model.N)
+    z = numpy.fromiter(itertools.chain(*model.z), numpy.int32, tokens)
+
+    # the model keeps views of the flat arrays, so handlers and the pure
+    # python algorithms continue to see (and modify) the same state
+    model.z = [z[offsets[i]:offsets[i + 1]] for i in range(model.M)]
+    model.c_t = numpy.array(model.c_t, numpy.int32)
+    model.c_dt = numpy.array(model.c_dt, numpy.int32)
+    model.c_tv = numpy.array(model.c_tv, numpy.int32, order='F')
+
+    return w, d, z
+
+
+def _numpy_gibbs(model, temp, sample_func):
+    w, d, z = _numpy_flatten(model)
+
+    alpha = model.alpha
+    beta = model.beta
+    Vbeta = model.Vbeta
+    c_t = model.c_t
+
+    # scalar updates on 1-d views are much cheaper than tuple indexing into
+    # the 2-d arrays, and c_tv is column major so each word's view is
+    # contiguous; the views share memory with the model's counts
+    doc_rows = list(model.c_dt)
+    word_cols = [model.c_tv[:, v] for v in range(model.V)]
+
+    exponent = 1 / temp
+    w_list = w.tolist()
+    d_list = d.tolist()
+
+    def sample_model():
+        changes = 0
+        randoms = numpy.random.random_sample(len(w_list)).tolist()
+        z_list = z.tolist()
+        for i, (d_i, w_i) in enumerate(itertools.izip(d_list, w_list)):
+            old_z = z_list[i]
+            doc_row = doc_rows[d_i]
+            word_col = word_cols[w_i]
+            c_t[old_z] -= 1
+            doc_row[old_z] -= 1
+            word_col[old_z] -= 1
+
+            probs = (alpha + doc_row) * (beta + word_col) / (Vbeta + c_t)
+            if exponent != 1:
+                probs **= exponent
+            z_i = sample_func(probs, randoms[i])
+            if z_i != old_z:
+                changes += 1
+                z[i] = z_i
+
+            c_t[z_i] += 1
+            doc_row[z_i] += 1
+            word_col[z_i] += 1
+
+        model.num_changes += changes
+
+    return sample_model
+
+
+def _numpy_argmax(probs, _):
+    return probs.argmax()
+
+
+def numpy_gibbs(model):
+    """
+    numpy_gibbs(VanillaLDA): func
+    Creates a Gibbs sampler for LDA which stores the corpus in flat int32
+    arrays and computes the full conditional of each token with numpy. The
+    per-token overhead of numpy makes it slower than 'gibbs' for small numbers
+    of topics; it wins from roughly T = 100 upward, and by about 5x at T = 200
+    """
+
+    return _numpy_gibbs(model, 1, compute.numpy_sample_counts)
+
+
+def annealed_numpy_gibbs(model, temp):
+    """
+    annealed_numpy_gibbs(VanillaLDA, float): func
+    Creates an annealed numpy Gibbs sampler for LDA
+    """
+
+    return _numpy_gibbs(model, temp, compute.numpy_sample_counts)
+
+
+def numpy_ccm(model):
+    """
+    numpy_ccm(VanillaLDA): func
+    Creates a numpy complete conditional maximization algorithm for LDA
+    """
+
+    return _numpy_gibbs(model, 1, _numpy_argmax)
+
+
+def _fold_in_probs(c_t, phi_v):
+    alpha = parallel.state['alpha']
+    return [(alpha + c_t[j]) * phi_v[j] for j in range(parallel.state['T'])]
+
+
+def _completion_lprob(doc):
+    phi = parallel.state['phi']
+    iterations = parallel.state['iterations']
+    observed, held_out = doc[:len(doc) // 2], doc[len(doc) // 2:]
+
+    z = [compute.sample_uniform(parallel.state['T']) for _ in observed]
+    c_t = [0 for _ in range(parallel.state['T'])]
+    for z_n in z:
+        c_t[z_n] += 1
+
+    # theta is averaged over the second half of the fold-in sweeps
+    theta = [0 for _ in range(parallel.state['T'])]
+    for i in range(iterations):
+        for n, w_n in enumerate(observed):
+            c_t[z[n]] -= 1
+            z[n] = compute.sample_counts(_fold_in_probs(c_t, phi[w_n]))
+            c_t[z[n]] += 1
+        if i >= iterations // 2:
+            for j, c_j in enumerate(c_t):
+                theta[j] += parallel.state['alpha'] + c_j
+    compute.normalize(theta)
+
+    lprob = 0
+    for w_n in held_out:
+        lprob += math.log(sum(t * p for t, p in zip(theta, phi[w_n])))
+    return lprob, len(held_out)
+
+
+def _left_to_right_lprob(doc):
+    phi = parallel.state['phi']
+    iterations = parallel.state['iterations']
+    Talpha = parallel.state['T'] * parallel.state['alpha']
+
+    probs = [0 for _ in doc]
+    for _ in range(iterations):
+        z = []
+        c_t = [0 for _ in range(parallel.state['T'])]
+        for n, w_n in enumerate(doc):
+            for m in range(n):
+                c_t[z[m]] -= 1
+                z[m] = compute.sample_counts(_fold_in_probs(c_t, phi[doc[m]]))
+                c_t[z[m]] += 1
+
+            counts = _fold_in_probs(c_t, phi[w_n])
+            probs[n] += sum(counts) / (n + Talpha)
+            z.append(compute.sample_counts(counts))
+            c_t[z[n]] += 1
+
+    lprob = sum(math.log(prob / iterations) for prob in probs)
+    return lprob, len(doc)
+
+
 class VanillaLDA(basic.TopicModel):
     """Latent Dirichlet Allocation with a Gibbs sampler"""
 
     algorithms = {'gibbs': gibbs,
                   'annealed gibbs': annealed_gibbs,
-                  'ccm': ccm}
+                  'ccm': ccm,
+                  'sparse gibbs': sparse_gibbs,
+                  'alias mh': alias_mh,
+                  'parallel gibbs': parallel_gibbs,
+                  'numpy gibbs': numpy_gibbs,
+                  'annealed numpy gibbs': annealed_numpy_gibbs,
+                  'numpy ccm': numpy_ccm}
     default_algorithm = 'ccm'
+    snapshot_attrs = ['T', 'alpha', 'beta', 'Vbeta',
+                      'z', 'c_t', 'c_dt', 'c_tv']
 
     def __init__(self, corpus, T, alpha, beta):
         basic.TopicModel.__init__(self, corpus)
@@ -79,9 +533,12 @@ class VanillaLDA(basic.TopicModel):
         """
         VanillaLDA.set_z(int, int, int): return None
         Sets the value of z_dn and updates the counters. Does not adjust the
-        counters for the previous value of z_dn.
+        counters for the previous value of z_dn. Changed assignments are
+        counted in num_changes.
         """
 
+        if self.z[d][n] != z_dn:
+            self.num_changes += 1
         self.z[d][n] = z_dn
 
         self.c_t[z_dn] += 1
@@ -116,6 +573,40 @@ class VanillaLDA(basic.TopicModel):
 
         return compute.top_n(self.c_dt[d], n)
 
+    def perplexity(self, corpus, iterations=20, method='completion',
+                   processes=1):
+        """
+        VanillaLDA.perplexity(Corpus, int, str, int): float
+        Computes the held-out perplexity of the provided Corpus, folding each
+        document in with Gibbs sampling against the frozen topics. With the
+        'completion' method, the topics of each document are sampled for the
+        given number of iterations on the first half of the document, which is
+        used to predict the second half. With the 'left-to-right' method, each
+        token is predicted from the preceding tokens, using iterations
+        particles. Documents are evaluated across the given number of
+        processes. Raises ValueError if iterations is less than 1 or if there
+        are no held-out tokens to predict.
+        """
+
+        evaluate = {'completion': _completion_lprob,
+                    'left-to-right': _left_to_right_lprob}[method]
+        if iterations < 1:
+            raise ValueError('perplexity requires at least one iteration')
+
+        words = set(v for doc in corpus for v in doc)
+        phi = {v: [(self.beta + self.c_tv[t][v]) / (self.Vbeta + self.c_t[t])
+                   for t in range(self.T)] for v in words}
+        state = {'phi': phi, 'alpha': self.alpha, 'T': self.T,
+                 'iterations': iterations}
+        results = parallel.pool_map(evaluate, list(corpus), state, processes,
+                                    16)
+
+        lprob = sum(lprob for lprob, _ in results)
+        num_tokens = sum(num_tokens for _, num_tokens in results)
+        if num_tokens == 0:
+            raise ValueError('the corpus has no held-out tokens')
+        return math.exp(-lprob / num_tokens)
+
     def print_state(self, verbose=False):
         for t in range(self.T):
             print '{0} -'.format(t),
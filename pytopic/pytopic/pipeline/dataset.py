@@ -2,7 +2,11 @@
 
 import os
 import re
-from pytopic.util import data
+import string
+import itertools
+import multiprocessing
+from pytopic.util import data, optional
+from pytopic.util.optional import numpy
 
 class Corpus(object):
     """A collection of text documents"""
@@ -41,30 +45,205 @@ class Corpus(object):
             yield self.data[i]
 
 
+class CompactCorpus(object):
+    """
+    A read-only Corpus stored as one contiguous array of token types along
+    with the offset of each document into that array
+    """
+
+    def __init__(self, vocab, titles, tokens, offsets):
+        optional.require('CompactCorpus')
+
+        self.vocab = vocab
+        self.titles = titles
+        self.tokens = tokens
+        self.offsets = offsets
+
+    @classmethod
+    def from_corpus(cls, corpus):
+        """
+        CompactCorpus.from_corpus(Corpus): return CompactCorpus
+        Returns a CompactCorpus with the same documents, vocab and titles as
+        the given Corpus
+        """
+
+        optional.require('CompactCorpus')
+
+        offsets = numpy.zeros(len(corpus) + 1, numpy.int64)
+        numpy.cumsum([len(doc) for doc in corpus], out=offsets[1:])
+        tokens = numpy.fromiter(itertools.chain.from_iterable(corpus),
+                                numpy.int32, offsets[-1])
+        return cls(corpus.vocab, corpus.titles, tokens, offsets)
+
+    @classmethod
+    def load(cls, dirpath, mmap=True):
+        """
+        CompactCorpus.load(str, bool): return CompactCorpus
+        Loads a CompactCorpus saved to the given directory. If mmap is True,
+        the token arrays are memory-mapped read-only instead of being read,
+        so that they open instantly and are shared between processes.
+        """
+
+        optional.require('CompactCorpus')
+
+        mmap_mode = 'r' if mmap else None
+        tokens = numpy.load(os.path.join(dirpath, 'tokens.npy'), mmap_mode)
+        offsets = numpy.load(os.path.join(dirpath, 'offsets.npy'), mmap_mode)
+        vocab = _load_index(os.path.join(dirpath, 'vocab.txt'))
+        titles = _load_index(os.path.join(dirpath, 'titles.txt'))
+        return cls(vocab, titles, tokens, offsets)
+
+    def save(self, dirpath):
+        """
+        CompactCorpus.save(str): return None
+        Saves the CompactCorpus to the given directory in a format which can
+        be memory-mapped by CompactCorpus.load
+        """
+
+        data.ensure_dirs(os.path.join(dirpath, 'tokens.npy'))
+        numpy.save(os.path.join(dirpath, 'tokens.npy'), self.tokens)
+        numpy.save(os.path.join(dirpath, 'offsets.npy'), self.offsets)
+        _save_index(self.vocab, os.path.join(dirpath, 'vocab.txt'))
+        _save_index(self.titles, os.path.join(dirpath, 'titles.txt'))
+
+    def get_text(self, doc_index):
+        """
+        CompactCorpus.get_text(int): return list of str
+        Returns the token symbols in the given document
+        """
+
+        return [self.vocab[i] for i in self[doc_index]]
+
+    def __getitem__(self, doc_index):
+        start, end = self.offsets[doc_index], self.offsets[doc_index + 1]
+        return self.tokens[start:end].tolist()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+def _save_index(index, filename):
+    with open(filename, 'w') as outfile:
+        for token in index:
+            print >> outfile, token
+
+
+def _load_index(filename):
+    index = data.Index()
+    with open(filename) as infile:
+        for token in infile:
+            index.add_unique(token.rstrip('\n'))
+    return index
+
+
 class CorpusReader(data.Reader):
     """Facilitates the construction of text corpora from files"""
 
+    # more shards than processes evens out the load when file sizes vary
+    shards_per_process = 4
+
     def __init__(self, tokenizer=None):
         data.Reader.__init__(self)
         self.tokenizer = Tokenizer() if tokenizer is None else tokenizer
 
-    def read(self):
+    def read(self, processes=1):
         """
-        CorpusReader.read(): return Corpus
-        Reads all of the files in the reader and constructs a new Corpus
+        CorpusReader.read(int): return Corpus
+        Reads all of the files in the reader and constructs a new Corpus. If
+        more than one process is requested, shards of the files are tokenized
+        in parallel and merged, giving the same Corpus as a serial read.
         """
 
+        if processes > 1:
+            return self._read_parallel(processes)
+
         corpus = Corpus()
         for filename, buff in self.get_files():
             for title, tokens in self.tokenizer.tokenize(filename, buff):
                 corpus.add_document(title, tokens)
         return corpus
 
+    def _read_parallel(self, processes):
+        filenames = sorted(self.filelist)
+        num_shards = min(len(filenames), processes * self.shards_per_process)
+        shards = [filenames[i * len(filenames) // num_shards:
+                            (i + 1) * len(filenames) // num_shards]
+                  for i in range(num_shards)]
+
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_tokenize_shard,
+                               [(self.tokenizer, shard) for shard in shards])
+        finally:
+            pool.close()
+            pool.join()
+
+        # merging the shards in order assigns the same token types as a
+        # serial read, since each local vocab is in order of first occurrence
+        corpus = Corpus()
+        for local_vocab, docs in results:
+            types = corpus.vocab.convert_tokens(local_vocab)
+            for title, local_tokens in docs:
+                doc_index = corpus.titles.add_unique(title)
+                corpus.data[doc_index] = [types[v] for v in local_tokens]
+        return corpus
+
+
+class CorpusStream(object):
+    """
+    Streams the documents of a CorpusReader as token types from a fixed
+    vocabulary, without keeping the corpus in memory. Tokens which are not in
+    the vocabulary are dropped. Each iteration rereads the files.
+    """
+
+    def __init__(self, reader, vocab):
+        self.reader = reader
+        self.vocab = vocab
+
+    def __iter__(self):
+        for filename, buff in self.reader.get_files():
+            for _, tokens in self.reader.tokenizer.tokenize(filename, buff):
+                yield [self.vocab.token_type(token) for token in tokens
+                       if token in self.vocab]
+
+
+def _tokenize_shard(args):
+    tokenizer, filenames = args
+    vocab = data.Index()
+    docs = []
+    for filename in filenames:
+        with open(filename) as buff:
+            for title, tokens in tokenizer.tokenize(filename, buff):
+                docs.append((title, vocab.convert_tokens(tokens)))
+    return list(vocab), docs
+
+
+# lowercases letters, maps whitespace to spaces and deletes everything else,
+# which is the default transform applied to a whole string at once
+_FAST_TABLE = string.maketrans(
+    string.ascii_uppercase + string.whitespace,
+    string.ascii_lowercase + ' ' * len(string.whitespace))
+_FAST_DELETE = ''.join(c for c in map(chr, range(256))
+                       if c not in string.ascii_letters + string.whitespace)
+
 
 class Tokenizer(object):
     """Performs tokenization for a CorpusReader"""
 
+    # files are read this many bytes at a time by the fast path
+    chunk_size = 2 ** 20
+
     def __init__(self, split_re=None, filter_re=None):
+        # with the default patterns and transform, tokens can be extracted
+        # with a translate table and a single split instead
+        transform = type(self).transform.im_func
+        self.fast = (split_re is None and filter_re is None and
+                     transform is Tokenizer.transform.im_func)
+
         if split_re is None:
             split_re = '\s+'
         if filter_re is None:
@@ -79,11 +258,37 @@ class Tokenizer(object):
         list of token symbols representing documents.
         """
 
+        if self.fast:
+            chunks = iter(lambda: buff.read(self.chunk_size), '')
+            yield filename, self.fast_tokens(chunks)
+            return
+
         tokens = self.split_re.split(buff.read())
         tokens = [self.transform(token) for token in tokens]
         tokens = [token for token in tokens if self.keep(token)]
         yield filename, tokens
 
+    def fast_tokens(self, chunks):
+        """
+        Tokenizer.fast_tokens(iterable of str): return list of str
+        Returns the kept token symbols of the concatenated chunks, which must
+        be the same as splitting and transforming with the default patterns.
+        Only a token spanning the end of a chunk is carried over to the next.
+        """
+
+        keep = self.keep
+        tokens = []
+        partial = ''
+        for chunk in chunks:
+            if isinstance(chunk, unicode):
+                chunk = chunk.encode('ascii', 'ignore')
+            text = partial + chunk.translate(_FAST_TABLE, _FAST_DELETE)
+            end = text.rfind(' ') + 1
+            tokens += [token for token in text[:end].split() if keep(token)]
+            partial = text[end:]
+        tokens += [token for token in partial.split() if keep(token)]
+        return tokens
+
     def transform(self, token):
         """
         Tokenizer.transform(str): return str
@@ -1,7 +1,8 @@
 """Functions for preprocessing a corpus"""
 
 from pytopic.pipeline import dataset
-from pytopic.util import compute
+from pytopic.util import compute, data, optional
+from pytopic.util.optional import numpy
 
 def filter_rarewords(corpus, threshold, retain_empty=False):
     """
@@ -41,6 +42,7 @@ def load_stopwords(*stopword_filenames):
 
     stopwords = set()
     for filename in stopword_filenames:
+        data.track_file(filename)
         for word in open(filename):
             word = word.strip()
             if len(word) > 0:
@@ -65,9 +67,128 @@ def split_corpus(corpus, training_proportion):
 
     for d in doc_ids[:break_point]:
         doc_index = training.titles.add_unique(corpus.titles[d])
-        training.data[doc_index] = corpus.data[d]
+        training.data[doc_index] = corpus[d]
     for d in doc_ids[break_point:]:
         doc_index = test.titles.add_unique(corpus.titles[d])
-        test.data[doc_index] = corpus.data[d]
+        test.data[doc_index] = corpus[d]
 
     return training, test
+
+
+class Pipeline(object):
+    """
+    A chain of corpus filters which is applied in a single pass over the token
+    ids, without ever converting the tokens back to strings
+    """
+
+    def __init__(self):
+        self._word_filters = []
+        self.min_length = 1
+
+    def filter_stopwords(self, stopwords):
+        """
+        Pipeline.filter_stopwords(set of str): return Pipeline
+        Adds a filter which removes all the stopwords in the given set
+        """
+
+        def remove(vocab, term_freq, doc_freq):
+            removed = numpy.zeros(len(vocab), bool)
+            for word in stopwords:
+                try:
+                    removed[vocab.token_type(word)] = True
+                except KeyError:
+                    pass
+            return removed
+
+        self._word_filters.append(remove)
+        return self
+
+    def filter_rarewords(self, threshold, by_docs=False):
+        """
+        Pipeline.filter_rarewords(int, bool): return Pipeline
+        Adds a filter which removes words occurring fewer than a threshold
+        number of times in the corpus, like filter_rarewords. If by_docs is
+        True, words are instead counted once per document they appear in.
+        """
+
+        if by_docs:
+            self._word_filters.append(lambda v, tf, df: df < threshold)
+        else:
+            self._word_filters.append(lambda v, tf, df: tf < threshold)
+        return self
+
+    def filter_frequentwords(self, threshold):
+        """
+        Pipeline.filter_frequentwords(int): return Pipeline
+        Adds a filter which removes words appearing in more than a threshold
+        amount of documents
+        """
+
+        self._word_filters.append(lambda v, tf, df: df > threshold)
+        return self
+
+    def filter_length(self, min_length):
+        """
+        Pipeline.filter_length(int): return Pipeline
+        Sets the minimum number of tokens a document must retain after word
+        filtering to be kept. A minimum of 0 retains empty documents.
+        """
+
+        self.min_length = min_length
+        return self
+
+    def apply(self, corpus):
+        """
+        Pipeline.apply(Corpus): return Corpus
+        Applies every filter in the pipeline to the given Corpus or
+        CompactCorpus, returning a new one of the same kind with a compacted
+        vocabulary. Token ids keep their relative order.
+        """
+
+        optional.require('the preprocess Pipeline')
+
+        compact = corpus
+        if not isinstance(corpus, dataset.CompactCorpus):
+            compact = dataset.CompactCorpus.from_corpus(corpus)
+        tokens = numpy.asarray(compact.tokens)
+        V = len(corpus.vocab)
+        M = len(corpus)
+
+        # term and document frequencies in one vectorized pass
+        doc_ids = numpy.repeat(numpy.arange(M), numpy.diff(compact.offsets))
+        term_freq = numpy.bincount(tokens, minlength=V)
+        pairs = numpy.unique(doc_ids * V + tokens)
+        doc_freq = numpy.bincount(pairs % V, minlength=V)
+
+        keep = numpy.ones(V, bool)
+        for word_filter in self._word_filters:
+            keep &= ~word_filter(corpus.vocab, term_freq, doc_freq)
+
+        types = numpy.cumsum(keep) - 1
+        kept = keep[tokens]
+        tokens = types[tokens[kept]].astype(numpy.int32)
+        doc_ids = doc_ids[kept]
+        lengths = numpy.bincount(doc_ids, minlength=M)
+
+        vocab = data.Index()
+        for v in numpy.flatnonzero(keep):
+            vocab.add_unique(corpus.vocab[v])
+
+        docs = numpy.flatnonzero(lengths >= self.min_length)
+        titles = data.Index()
+        for d in docs:
+            titles.add_unique(corpus.titles[d])
+
+        tokens = tokens[(lengths >= self.min_length)[doc_ids]]
+        offsets = numpy.zeros(len(docs) + 1, numpy.int64)
+        numpy.cumsum(lengths[docs], out=offsets[1:])
+
+        filtered = dataset.CompactCorpus(vocab, titles, tokens, offsets)
+        if isinstance(corpus, dataset.CompactCorpus):
+            return filtered
+
+        transformed = dataset.Corpus()
+        transformed.vocab = vocab
+        transformed.titles = titles
+        transformed.data = dict(enumerate(filtered))
+        return transformed
@@ -0,0 +1,78 @@
+"""Generates synthetic corpora from the generative processes of the models"""
+
+from __future__ import division
+
+import random
+from pytopic.pipeline import dataset
+from pytopic.util import compute
+
+def sample_dirichlet(alpha, dim):
+    """
+    sample_dirichlet(float, int): return list of float
+    Returns a sample from a symmetric Dirichlet with the given dimension
+    """
+
+    sample = [random.gammavariate(alpha, 1) for _ in range(dim)]
+    total = sum(sample)
+    if total == 0: # possible when every gamma variate underflows
+        return [1 / dim for _ in range(dim)]
+    return [x / total for x in sample]
+
+
+def _init_corpus(V):
+    corpus = dataset.Corpus()
+    corpus.vocab.convert_tokens('w{0}'.format(v) for v in range(V))
+    return corpus
+
+
+def _sample_length(doc_length):
+    return random.randint((doc_length + 1) // 2, doc_length * 3 // 2)
+
+
+def lda_corpus(M, V, T, doc_length, alpha, beta):
+    """
+    lda_corpus(int, int, int, int, float, float): return Corpus, list, list
+    Samples a Corpus of M documents from the LDA generative process, with
+    document lengths uniform around doc_length. Returns the Corpus along with
+    the true topic-word distributions and document-topic distributions. The
+    token types of the Corpus are the word indices of the distributions.
+    """
+
+    topics = [sample_dirichlet(beta, V) for _ in range(T)]
+    tables = [compute.alias_table(phi) for phi in topics]
+    thetas = [sample_dirichlet(alpha, T) for _ in range(M)]
+
+    corpus = _init_corpus(V)
+    for d, theta in enumerate(thetas):
+        theta_table = compute.alias_table(theta)
+        tokens = []
+        for _ in range(_sample_length(doc_length)):
+            t = compute.sample_alias(theta_table)
+            tokens.append(corpus.vocab[compute.sample_alias(tables[t])])
+        corpus.add_document(str(d), tokens)
+
+    return corpus, topics, thetas
+
+
+def mixture_corpus(M, V, K, doc_length, gamma, beta):
+    """
+    mixture_corpus(int, int, int, int, float, float): return Corpus, list, list
+    Samples a Corpus of M documents from the mixture of multinomials
+    generative process, with document lengths uniform around doc_length.
+    Returns the Corpus along with the true cluster-word distributions and
+    document cluster labels. Document titles are of the form cluster/doc, so
+    that Clustering.from_corpus gives the true clustering.
+    """
+
+    clusters = [sample_dirichlet(beta, V) for _ in range(K)]
+    tables = [compute.alias_table(phi) for phi in clusters]
+    lambda_table = compute.alias_table(sample_dirichlet(gamma, K))
+    labels = [compute.sample_alias(lambda_table) for _ in range(M)]
+
+    corpus = _init_corpus(V)
+    for d, k in enumerate(labels):
+        tokens = [corpus.vocab[compute.sample_alias(tables[k])]
+                  for _ in range(_sample_length(doc_length))]
+        corpus.add_document('{0}/{1}'.format(k, d), tokens)
+
+    return corpus, clusters, labels
@@ -29,6 +29,13 @@ class BibleTokenizer(dataset.Tokenizer):
             if line == '':
                 continue
 
+            if self.fast:
+                split = line.split(None, 1)
+                tokens = self.fast_tokens(split[1:])
+                if len(tokens) > 0:
+                    yield split[0], tokens
+                continue
+
             split = self.split_re.split(line)
             title, tokens = split[0], split[1:]
             tokens = [self.transform(token) for token in tokens]
@@ -43,15 +50,25 @@ class HTMLTokenizer(dataset.Tokenizer):
     def __init__(self, split_re=None, filter_re=None):
         dataset.Tokenizer.__init__(self, split_re, filter_re)
 
+    # borrowed from nltk.clean_html, which falls under Apache License 2.0
+    html_subs = [(re.compile(r'(?is)<(script|style).*?>.*?(</\1>)'), ''),
+                 (re.compile(r'(?s)<!--(.*?)-->[\n]?'), ''),
+                 (re.compile(r'(?s)<.*?>'), ' '),
+                 (re.compile(r'&nbsp;'), ' ')]
+
     def tokenize(self, filename, buff):
-        # borrowed from nltk.clean_html, which falls under Apache License 2.0
         text = buff.read().strip()
-        text = re.sub(r'(?is)<(script|style).*?>.*?(</\1>)', '', text)
-        text = re.sub(r'(?s)<!--(.*?)-->[\n]?', '', text)
-        text = re.sub(r'(?s)<.*?>', ' ', text)
-        text = re.sub(r'&nbsp;', ' ', text)
+        for html_re, replacement in self.html_subs:
+            text = html_re.sub(replacement, text)
+
+        # the default split ignores the extra whitespace tidied up below
+        if self.fast:
+            yield filename, self.fast_tokens([text])
+            return
+
         text = re.sub(r'  ', ' ', text)
         text = re.sub(r'  ', ' ', text)
         text = text.strip()
-        buff = StringIO.StringIO(text) 
-        return dataset.Tokenizer.tokenize(self, filename, buff)
+        buff = StringIO.StringIO(text)
+        for doc in dataset.Tokenizer.tokenize(self, filename, buff):
+            yield doc
@@ -4,6 +4,7 @@ from __future__ import division
 
 import math
 import random
+from pytopic.util.optional import numpy
 
 def sample_uniform(dim):
     """
@@ -45,6 +46,48 @@ def sample_lcounts(lcounts):
     raise ValueError()
 
 
+def alias_table(counts):
+    """
+    alias_table(list of float): return tuple of list
+    Builds a Walker alias table from the given counts, so that sample_alias
+    can sample an index proportional to the counts in constant time
+    """
+
+    dim = len(counts)
+    total = sum(counts)
+    probs = [count * dim / total for count in counts]
+    aliases = range(dim)
+
+    small = [i for i in aliases if probs[i] < 1]
+    large = [i for i in aliases if probs[i] >= 1]
+    while small and large:
+        less, more = small.pop(), large.pop()
+        aliases[less] = more
+        probs[more] -= 1 - probs[less]
+        if probs[more] < 1:
+            small.append(more)
+        else:
+            large.append(more)
+
+    for i in small + large: # only off from 1 through floating point rounding
+        probs[i] = 1
+
+    return probs, aliases
+
+
+def sample_alias(table):
+    """
+    sample_alias(tuple of list): return int
+    Returns an integer index sampled using a table built by alias_table
+    """
+
+    probs, aliases = table
+    key = random.randrange(len(probs))
+    if random.random() < probs[key]:
+        return key
+    return aliases[key]
+
+
 def sample_order(dim):
     """
     sample_order(int): return list of int
@@ -75,10 +118,12 @@ def lsum(lcounts):
     Returns the log sum of the log space counts
     """
 
-    ltotal = float('-inf')
-    for lcount in lcounts:
-        ltotal = ladd(ltotal, lcount)
-    return ltotal
+    # shifting by the max needs one exp per count and a single log
+    lcounts = list(lcounts)
+    lmax = max(lcounts) if lcounts else float('-inf')
+    if math.isinf(lmax):
+        return lmax
+    return lmax + math.log(sum(math.exp(lcount - lmax) for lcount in lcounts))
 
 
 def n_choose_2(n):
@@ -107,11 +152,9 @@ def lnormalize(counts):
     Normalizes the count list in log space
     """
 
-    lsum = float('-inf')
-    for count in counts:
-        lsum = ladd(lsum, count)
+    ltotal = lsum(counts)
     for i in range(len(counts)):
-        counts[i] -= lsum
+        counts[i] -= ltotal
 
 
 def top_n(counts, n, only_positive=True):
@@ -162,6 +205,11 @@ def lim_xlogy(x, y):
 # both the digamma and trigamma algorithms are ported from Apache Commons,
 # which is released under the Apache 2.0 license, just like PyTopic
 
+# below this point the asymptotic series lose double precision, so smaller
+# arguments are first shifted up using the recurrences
+_SERIES_MIN = 10
+
+
 def digamma(x):
     """
     digamma(float): float
@@ -170,14 +218,12 @@ def digamma(x):
     values of x.
     """
 
-    if 0 < x <= 1e-5:
-        return -.577215664901532860606512090082 - 1 / x
-    elif x >= 49:
-        inv = 1/ (x * x)
-        lx = math.log(x)
-        return lx - .5 / x - inv * ((1 / 12) + inv * (1 / 120 - inv / 252))
-    else:
-        return digamma(x + 1) - 1 / x
+    # digamma(x) = digamma(x + 1) - 1 / x
+    shift = 0
+    while x < _SERIES_MIN:
+        shift -= 1 / x
+        x += 1
+    return shift + _digamma_series(x)
 
 
 def trigamma(x):
@@ -188,13 +234,26 @@ def trigamma(x):
     values of x.
     """
 
+    # trigamma(x) = trigamma(x + 1) + 1 / x^2
+    shift = 0
+    while x < _SERIES_MIN:
+        shift += 1 / (x * x)
+        x += 1
+    return shift + _trigamma_series(x)
+
+
+def _digamma_series(x):
+    inv = 1 / (x * x)
+    series = inv * (1 / 12 - inv * (1 / 120 - inv * (1 / 252 - inv * (
+        1 / 240 - inv * (1 / 132 - inv * (691 / 32760 - inv / 12))))))
+    return math.log(x) - .5 / x - series
+
+
+def _trigamma_series(x):
     inv = 1 / (x * x)
-    if 0 < x <= 1e-5:
-        return inv
-    elif x >= 49:
-        return 1 / x + inv / 2 + inv / x * (1 / 6 - inv * (1 / 30 + inv / 42))
-    else:
-        return trigamma(x + 1) + inv
+    series = inv / x * (1 / 6 - inv * (1 / 30 - inv * (1 / 42 - inv * (
+        1 / 30 - inv * (5 / 66 - inv * (691 / 2730 - inv * 7 / 6))))))
+    return 1 / x + inv / 2 + series
 
 
 def argmax(counts):
@@ -204,3 +263,50 @@ def argmax(counts):
     """
 
     return max(range(len(counts)), key=lambda i: counts[i])
+
+
+def numpy_lsum(lcounts, axis=-1):
+    """
+    numpy_lsum(numpy.ndarray, int): return numpy.ndarray
+    Returns the log sum of the log space counts along the given axis, keeping
+    that axis with length 1 so that the result broadcasts against the counts
+    """
+
+    lmax = lcounts.max(axis=axis, keepdims=True)
+    lmax[numpy.isinf(lmax)] = 0 # all -inf counts sum to -inf, not nan
+    with numpy.errstate(divide='ignore'):
+        sums = numpy.exp(lcounts - lmax).sum(axis=axis, keepdims=True)
+        return numpy.log(sums) + lmax
+
+
+def numpy_lnormalize(lcounts, axis=-1):
+    """
+    numpy_lnormalize(numpy.ndarray, int): None
+    Normalizes the log space counts in place along the given axis
+    """
+
+    lcounts -= numpy_lsum(lcounts, axis)
+
+
+def numpy_sample_counts(counts, rand=None):
+    """
+    numpy_sample_counts(numpy.ndarray, float): return int
+    Returns an integer index sampled proportional to the given counts, using
+    the given uniform random number in [0, 1) if there is one
+    """
+
+    if rand is None:
+        rand = numpy.random.random_sample()
+    cdf = counts.cumsum()
+    return min(int(cdf.searchsorted(rand * cdf[-1], 'right')), len(cdf) - 1)
+
+
+def numpy_sample_lcounts(lcounts, rand=None):
+    """
+    numpy_sample_lcounts(numpy.ndarray, float): return int
+    Returns an integer index sampled proportional to the given log counts,
+    using the given uniform random number in [0, 1) if there is one
+    """
+
+    return numpy_sample_counts(numpy.exp(lcounts - lcounts.max()), rand)
+
@@ -2,7 +2,14 @@
 
 import os
 import errno
+import shutil
+import hashlib
+import contextlib
 import pickle
+import cPickle
+import tempfile
+from pytopic.util import optional
+from pytopic.util.optional import numpy, sparse
 
 class Index(object):
     """A mapping from unique token types, to the token symbols"""
@@ -71,16 +78,29 @@ class Index(object):
     def __len__(self):
         return len(self._tokens)
 
+    def __contains__(self, token):
+        return token in self._types
+
     def __getitem__(self, token_type):
         return self._tokens[token_type]
 
 
+# each active file_cache call collects the filelists of its inputs here
+_active_inputs = []
+# and the paths of the cache entries being computed, for cache_entry_dir
+_active_entries = []
+
+
 class Reader(object):
     """Base class for data import from text files"""
 
     def __init__(self):
         self.filelist = set()
 
+        # lets file_cache record the input files of the function it caches
+        for inputs in _active_inputs:
+            inputs.append(self.filelist)
+
     def add_file(self, filename):
         """
         Reader.add_file(str): None
@@ -103,7 +123,10 @@ class Reader(object):
         elif not os.path.isdir(dirpath):
             raise RuntimeError('{} is not a directory'.format(dirpath))
 
+        # a directory's mtime changes when files are added to or removed from
+        # it, so tracking every directory walked keeps file_cache up to date
         for root, dirs, files in os.walk(dirpath):
+            track_file(root)
             self.filelist.update(os.path.join(root, f) for f in files)
 
     def add_index(self, indexname, data_dir=''):
@@ -114,6 +137,7 @@ class Reader(object):
         which the index file indexes
         """
 
+        track_file(indexname)
         with open(indexname) as filelist:
             for filename in filelist:
                 filename = filename.strip()
@@ -128,6 +152,7 @@ class Reader(object):
         """
 
         for root, _, files in os.walk(dirpath):
+            track_file(root)
             for indexfile in files:
                 self.add_index(os.path.join(root, indexfile), data_dir)
 
@@ -163,6 +188,26 @@ def init_counter(*dims):
         return [init_counter(*dims[1:]) for _ in range(dims[0])]
 
 
+def doc_term_matrix(docs, V):
+    """
+    doc_term_matrix(list of list of int, int): csr_matrix
+    Returns a sparse matrix in CSR format with a row for each document, giving
+    the number of times each of the V token types occurs in that document
+    """
+
+    optional.require('sparse matrices', scipy=True)
+
+    sizes = [len(doc) for doc in docs]
+    rows = numpy.repeat(numpy.arange(len(docs), dtype=numpy.int32), sizes)
+    cols = numpy.fromiter((v for doc in docs for v in doc), numpy.int32,
+                          sum(sizes))
+    counts = numpy.ones(len(cols), numpy.int32)
+
+    matrix = sparse.csr_matrix((counts, (rows, cols)), (len(docs), V))
+    matrix.sum_duplicates()
+    return matrix
+
+
 def ensure_dirs(path):
     """
     ensure_dirs(str): None
@@ -198,3 +243,194 @@ def pickle_cache(pickle_path):
                 return data
         return load_data
     return cache
+
+
+def file_cache(cache_dir, max_size=2 ** 32):
+    """
+    file_cache(str, int): decorator
+    Creates a decorator which caches the results of a function in the given
+    directory, keyed on the function and its arguments. The files of every
+    Reader created by the function, the directories and index files they were
+    added from, and any files registered with track_file, are recorded along
+    with their modification times and sizes, and the cached result is
+    recomputed if any of them change, so adding a file to a directory read
+    with add_dir also invalidates the result. Results are
+    written atomically in binary pickle format, and the least recently used
+    results are evicted once the directory holds more than max_size bytes.
+
+    Arguments are keyed by their cache_tag, so a result of one cached function
+    passed to another, such as a Corpus, is keyed by the call which produced
+    it instead of being pickled. Such results should not be modified.
+
+    A function which stores part of its result outside the pickle can use
+    cache_entry_dir, which is counted and evicted along with the entry.
+    """
+
+    def cache(data_func):
+        def load_data(*args, **kwargs):
+            key = (data_func.__module__, data_func.__name__,
+                   [cache_tag(arg) for arg in args],
+                   sorted((name, cache_tag(kwargs[name])) for name in kwargs))
+            key = hashlib.sha1(cPickle.dumps(key, cPickle.HIGHEST_PROTOCOL))
+            path = os.path.join(cache_dir, key.hexdigest())
+
+            try:
+                with open(path, 'rb') as infile:
+                    stats = cPickle.load(infile)
+                    if stats == _file_stats(name for name, _, _ in stats):
+                        data = cPickle.load(infile)
+                        os.utime(path, None)
+                        _set_cache_tag(data, key, stats)
+                        return data
+            except (IOError, EOFError, cPickle.UnpicklingError):
+                pass # missing, stale or partially written results
+
+            shutil.rmtree(_entry_dir(path), ignore_errors=True)
+            inputs = []
+            _active_inputs.append(inputs)
+            _active_entries.append(path)
+            try:
+                data = data_func(*args, **kwargs)
+            finally:
+                _active_inputs.pop()
+                _active_entries.pop()
+
+            filenames = set()
+            for filelist in inputs:
+                filenames.update(filelist)
+
+            stats = _file_stats(filenames)
+            atomic_dump(path, stats, data)
+            _evict_cache(cache_dir, max_size)
+            _set_cache_tag(data, key, stats)
+            return data
+        return load_data
+    return cache
+
+
+def cache_entry_dir():
+    """
+    cache_entry_dir(): str
+    Returns a directory belonging to the cache entry of the file_cache call in
+    progress, for results which store data alongside their pickle, such as
+    the arrays of a memory-mapped index. The directory is removed when the
+    entry is recomputed or evicted, and its size counts towards max_size.
+    """
+
+    if not _active_entries:
+        raise RuntimeError('cache_entry_dir requires a file_cache call')
+    return _entry_dir(_active_entries[-1])
+
+
+def _entry_dir(path):
+    return path + '.d'
+
+
+def cache_tag(obj):
+    """
+    cache_tag(object): str
+    Returns a fingerprint of the object for keying cached results. Results of
+    a file_cache call are fingerprinted by that call and the state of its
+    input files, while anything else is fingerprinted by its pickle.
+    """
+
+    try:
+        return obj._file_cache_tag
+    except AttributeError:
+        pickled = cPickle.dumps(obj, cPickle.HIGHEST_PROTOCOL)
+        return hashlib.sha1(pickled).hexdigest()
+
+
+def _set_cache_tag(data, key, stats):
+    # a rebuilt result gets a new tag, so results derived from it are rebuilt
+    key = key.copy()
+    key.update(repr(stats))
+    try:
+        data._file_cache_tag = key.hexdigest()
+    except (AttributeError, TypeError):
+        pass # builtins such as lists and sets cannot be tagged
+
+
+def track_file(filename):
+    """
+    track_file(str): None
+    Records a file or directory read without a Reader as an input of the
+    file_cache call in progress, if any, so that changes to it invalidate the
+    cached result
+    """
+
+    for inputs in _active_inputs:
+        inputs.append([filename])
+
+
+def _file_stats(filenames):
+    stats = []
+    for filename in sorted(filenames):
+        try:
+            stat = os.stat(filename)
+            stats.append((filename, stat.st_mtime, stat.st_size))
+        except OSError:
+            stats.append((filename, None, None))
+    return stats
+
+
+def atomic_dump(path, *objs):
+    """
+    atomic_dump(str, *object): None
+    Pickles the objects in binary format to a temporary file which is then
+    renamed to the given path, so that readers never see a partial file
+    """
+
+    with _atomic_file(path) as outfile:
+        for obj in objs:
+            cPickle.dump(obj, outfile, cPickle.HIGHEST_PROTOCOL)
+
+
+def atomic_write(path, contents):
+    """
+    atomic_write(str, str): None
+    Writes the bytes to a temporary file which is then renamed to the given
+    path, so that readers never see a partial file
+    """
+
+    with _atomic_file(path) as outfile:
+        outfile.write(contents)
+
+
+@contextlib.contextmanager
+def _atomic_file(path):
+    ensure_dirs(path)
+    fd, temp_path = tempfile.mkstemp('.tmp', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as outfile:
+            yield outfile
+        os.rename(temp_path, path)
+    except:
+        os.remove(temp_path)
+        raise
+
+
+def _evict_cache(cache_dir, max_size):
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if not name.endswith('.tmp') and os.path.isfile(path):
+            stat = os.stat(path)
+            size = stat.st_size + _dir_size(_entry_dir(path))
+            entries.append((stat.st_mtime, size, path))
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+        os.remove(path)
+        shutil.rmtree(_entry_dir(path), ignore_errors=True)
+        total_size -= size
+
+
+def _dir_size(dirpath):
+    size = 0
+    for root, _, files in os.walk(dirpath):
+        for filename in files:
+            size += os.path.getsize(os.path.join(root, filename))
+    return size
@@ -1,7 +1,12 @@
+import sys
 import time
-import pickle
+import pstats
+import cProfile
+import resource
+import threading
 from pytopic.model import basic
 from pytopic.analysis import cluster
+from pytopic.util import data, optional
 
 class Printer(basic.IterationHandler):
     """Calls print_state on the model at a specified iteration interval"""
@@ -29,51 +34,77 @@ class Timer(basic.IterationHandler):
 
 
 class Checkpointer(basic.IterationHandler):
-    """Pickles the model at the specified time interval"""
+    """
+    Snapshots the model at the specified time interval. The snapshot is
+    pickled in the foreground and then written from a background thread, so
+    that inference continues while the file is written.
+    """
 
     def __init__(self, time_interval, filename):
         self.time_interval = time_interval
         self.filename = filename
         self.last_time = time.time()
+        self._writer = None
 
     def handle(self, model):
         curr_time = time.time()
-        if self.last_time - curr_time >= self.time_interval:
+        if curr_time - self.last_time >= self.time_interval:
             self.last_time = curr_time
-            with open(self.filename, 'w') as outfile:
-                pickle.dump(model, outfile)
+            snapshot = model.snapshot_bytes()
+
+            self.wait()
+            self._writer = threading.Thread(target=data.atomic_write,
+                                            args=(self.filename, snapshot))
+            self._writer.start()
+
+    def finish(self, model):
+        self.wait()
+
+    def wait(self):
+        """
+        Checkpointer.wait(): None
+        Blocks until the last snapshot has been written
+        """
+
+        if self._writer is not None:
+            self._writer.join()
+            self._writer = None
 
 
 class ClusterConvergeceCheck(basic.IterationHandler):
-    """Raises a StopIteration exception if the clustering model converges"""
+    """
+    Raises a StopIteration exception if the clustering model converges, which
+    is when at most epsilon * M document assignments changed in the iteration.
+    The initial state once passed as the first argument is no longer needed
+    and is ignored, so epsilon must be given by keyword.
+    """
 
-    def __init__(self, init_state):
-        self.last_state = [k for k in init_state]
+    def __init__(self, init_state=None, epsilon=0):
+        # init_state is unused, and only keeps older positional calls working
+        self.epsilon = epsilon
 
     def handle(self, model):
-        model_changed = False
-        for d, k_d in enumerate(model.k):
-            if self.last_state[d] != k_d:
-                self.last_state[d] = k_d
-                model_changed = True
-        if not model_changed:
+        if model.num_changes <= self.epsilon * model.M:
             raise StopIteration()
 
 
 class TopicConvergenceCheck(basic.IterationHandler):
-    """Raises a StopIteration exception if the topic model converges"""
-
-    def __init__(self, init_state):
-        self.last_state = [[z for z in doc_state] for doc_state in init_state]
+    """
+    Raises a StopIteration exception if the topic model converges, which is
+    when at most epsilon * N token assignments changed in the iteration. The
+    initial state once passed as the first argument is no longer needed and
+    is ignored, so epsilon must be given by keyword.
+    """
+
+    def __init__(self, init_state=None, epsilon=0):
+        # init_state is unused, and only keeps older positional calls working
+        self.epsilon = epsilon
+        self.num_tokens = None
 
     def handle(self, model):
-        model_changed = False
-        for d, z_d in enumerate(model.z):
-            for n, z_dn in enumerate(z_d):
-                if self.last_state[d][n] != z_dn:
-                    self.last_state[d][n] = z_dn
-                    model_changed = True
-        if not model_changed:
+        if self.num_tokens is None:
+            self.num_tokens = sum(model.N)
+        if model.num_changes <= self.epsilon * self.num_tokens:
             raise StopIteration()
 
 
@@ -84,15 +115,36 @@ class MetricPrinter(basic.IterationHandler):
         self.iter_interval = iter_interval
         self.gold_clustering = gold_clustering
 
+        if not optional.available():
+            self.contingency = cluster.Contingency
+        else:
+            self.contingency = cluster.ContingencyMatrix
+
     def handle(self, model):
         if model.num_iters % self.iter_interval == 0:
-            pred = cluster.Clustering.from_model(model)
-            contingency = cluster.Contingency(self.gold_clustering, pred)
+            with model.phase('metric contingency'):
+                pred = cluster.Clustering.from_model(model)
+                contingency = self.contingency(self.gold_clustering, pred)
+
+            with model.phase('metric ari'):
+                print 'ARI', cluster.ari(contingency)
+            with model.phase('metric f-measure'):
+                print 'FM', cluster.f_measure(contingency)
+            with model.phase('metric vi'):
+                print 'VI', cluster.variation_info(contingency)
+            with model.phase('metric likelihood'):
+                print 'Likelihood', model.likelihood()
+
+
+class AcceptancePrinter(basic.IterationHandler):
+    """Prints the acceptance rate of a Metropolis-Hastings sampler"""
 
-            print 'ARI', cluster.ari(contingency)
-            print 'FM', cluster.f_measure(contingency)
-            print 'VI', cluster.variation_info(contingency)
-            print 'Likelihood', model.likelihood()
+    def __init__(self, iter_interval):
+        self.iter_interval = iter_interval
+
+    def handle(self, model):
+        if model.num_iters % self.iter_interval == 0:
+            print 'Acceptance', model.acceptance_rate
 
 
 class StatePrinter(basic.IterationHandler):
@@ -116,3 +168,77 @@ class StateTimePrinter(basic.IterationHandler):
     def handle(self, model):
         print time.time() - self.start_time, repr(self.state).replace(' ', '')
 
+
+
+class Profiler(basic.IterationHandler):
+    """
+    Prints a summary table of the time spent in each phase of inference, the
+    throughput and the peak memory at the end of each call to inference.
+    Every profile_interval iterations, the following iteration is also run
+    under the Python profiler, and those statistics are printed as well.
+    """
+
+    def __init__(self, profile_interval=None, outfile=sys.stdout):
+        self.profile_interval = profile_interval
+        self.outfile = outfile
+        self.iterations = 0
+        self._profile = None
+        self._profiling = False
+
+    def handle(self, model):
+        if self._profiling:
+            self._profile.disable()
+            self._profiling = False
+
+        self.iterations += 1
+
+        interval = self.profile_interval
+        if interval and model.num_iters % interval == 0:
+            if self._profile is None:
+                self._profile = cProfile.Profile()
+            self._profile.enable()
+            self._profiling = True
+
+    def finish(self, model):
+        if self._profiling:
+            self._profile.disable()
+            self._profiling = False
+
+        phase_times = model.phase_times
+        total_time = sum(seconds for name, seconds in phase_times.items()
+                         if name == 'sampling' or name.startswith('handler '))
+        iterations = max(self.iterations, 1)
+
+        row = '{0:<32}{1:>12.4f}{2:>12.4f}{3:>8.1f}'
+        print >> self.outfile, '{0:<32}{1:>12}{2:>12}{3:>8}'.format(
+            'phase', 'seconds', 'sec/iter', '%')
+        for name, seconds in sorted(phase_times.items(), key=lambda x: -x[1]):
+            percent = 100 * seconds / total_time if total_time else 0
+            print >> self.outfile, row.format(name, seconds,
+                                              seconds / iterations, percent)
+
+        sampling_time = phase_times.get('sampling', 0)
+        if hasattr(model, 'N') and sampling_time:
+            tokens = sum(model.N) * iterations
+            print >> self.outfile, 'tokens/sec', tokens / sampling_time
+            docs = model.M * iterations
+            print >> self.outfile, 'docs/sec', docs / sampling_time
+        print >> self.outfile, 'peak rss mb', peak_rss()
+
+        if self._profile is not None:
+            stats = pstats.Stats(self._profile, stream=self.outfile)
+            stats.sort_stats('cumulative').print_stats(20)
+            self._profile = None
+
+        self.iterations = 0
+
+
+def peak_rss():
+    """
+    peak_rss(): float
+    Returns the peak resident set size of the process in megabytes
+    """
+
+    # ru_maxrss is in kilobytes on Linux but in bytes on OS X
+    scale = 2 ** 20 if sys.platform == 'darwin' else 2 ** 10
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / float(scale)
@@ -0,0 +1,37 @@
+"""
+Optional imports of numpy and scipy. Neither is available under PyPy, which
+otherwise runs PyTopic much faster, so the pure python code never requires
+them. Modules import numpy, sparse and special from here, where anything
+which failed to import is None, and call require before using them.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    from scipy import sparse, special
+except ImportError:
+    sparse = special = None
+
+
+def available(scipy=False):
+    """
+    available(bool): return bool
+    Returns True if numpy, and scipy as well if requested, can be used
+    """
+
+    return numpy is not None and (not scipy or sparse is not None)
+
+
+def require(feature, scipy=False):
+    """
+    require(str, bool): None
+    Raises a RuntimeError naming the feature unless numpy, and scipy as well
+    if requested, can be used
+    """
+
+    if not available(scipy):
+        needed = 'numpy and scipy are' if scipy else 'numpy is'
+        raise RuntimeError('{} required for {}'.format(needed, feature))
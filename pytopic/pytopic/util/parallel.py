@@ -0,0 +1,47 @@
+"""Helpers for spreading work across forked worker processes"""
+
+import random
+import multiprocessing
+
+# the shared inputs of the pool_map in progress, which workers are given once
+# when they start instead of receiving them along with every item
+state = {}
+
+
+def reseed():
+    """
+    reseed(): None
+    Reseeds random in a newly forked worker, which otherwise shares the random
+    stream of its parent and of every other worker
+    """
+
+    random.seed()
+
+
+def _init_worker(worker_state):
+    reseed()
+    state.update(worker_state)
+
+
+def pool_map(func, items, worker_state, processes=1, chunksize=1):
+    """
+    pool_map(func, list, dict, int, int): return list
+    Applies func to each of the items, across the given number of worker
+    processes if there is more than one. While the map runs, func can read the
+    worker_state dict from parallel.state, which is cleared again afterwards
+    so that it does not keep the inputs alive.
+    """
+
+    if processes <= 1:
+        state.update(worker_state)
+        try:
+            return [func(item) for item in items]
+        finally:
+            state.clear()
+
+    pool = multiprocessing.Pool(processes, _init_worker, (worker_state,))
+    try:
+        return pool.map(func, items, chunksize)
+    finally:
+        pool.close()
+        pool.join()
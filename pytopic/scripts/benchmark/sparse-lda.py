@@ -0,0 +1,24 @@
+#!/usr/bin/pypy
+
+import time
+from pytopic.model import vanilla
+from scripts.corpora import newsgroups
+
+TOPIC_COUNTS = [20, 100, 1000]
+INFERENCE_ALGORITHMS = ['gibbs', 'sparse gibbs']
+ITERATIONS = 5
+
+def time_iteration(corpus, T, inference):
+    model = vanilla.VanillaLDA(corpus, T, .4, .01)
+    model.set_inference(inference)
+
+    start_time = time.time()
+    model.inference(ITERATIONS)
+    return (time.time() - start_time) / ITERATIONS
+
+if __name__ == '__main__':
+    corpus = newsgroups.get_corpus()
+
+    for T in TOPIC_COUNTS:
+        for algorithm in INFERENCE_ALGORITHMS:
+            print T, repr(algorithm), time_iteration(corpus, T, algorithm)
@@ -0,0 +1,139 @@
+#!/usr/bin/pypy
+"""
+Times every registered inference algorithm on synthetic corpora. Results are
+written as whitespace separated columns, one directory per model and
+algorithm and one file per run, so evilplot.crawl_results can plot them:
+
+    iteration seconds seconds/iteration tokens/sec peak-rss-mb quality
+
+Quality is the mean best cosine similarity between the true and recovered
+topics for LDA, and the ARI against the true clustering for mixtures.
+"""
+
+from __future__ import division
+
+import os
+import math
+import time
+import random
+import argparse
+import platform
+import multiprocessing
+from pytopic.model import basic, vanilla, mixmulti
+from pytopic.pipeline import synthetic
+from pytopic.analysis import cluster
+from pytopic.util import handler
+
+MODELS = {'lda': vanilla.VanillaLDA, 'mom': mixmulti.MixtureMultinomial}
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--models', nargs='+', default=sorted(MODELS),
+                        help='Models to benchmark ({})'.format(
+                            ', '.join(sorted(MODELS))))
+    parser.add_argument('-a', '--algorithms', nargs='+',
+                        help='Algorithms to benchmark (default all)')
+    parser.add_argument('-M', type=int, default=1000, help='Documents')
+    parser.add_argument('-V', type=int, default=2000, help='Vocab size')
+    parser.add_argument('-T', type=int, default=20, help='Topics/clusters')
+    parser.add_argument('-L', type=int, default=100, help='Document length')
+    parser.add_argument('-i', '--iterations', type=int, default=10)
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('-o', '--outdir', default='../results/benchmark')
+    return parser.parse_args()
+
+
+def cosine(x, y):
+    norm = math.sqrt(sum(a * a for a in x) * sum(b * b for b in y))
+    return sum(a * b for a, b in zip(x, y)) / norm
+
+
+def topic_quality(model, topics):
+    recovered = [[model.beta + c for c in model.c_tv[t]]
+                 for t in range(model.T)]
+    return sum(max(cosine(phi, phi_hat) for phi_hat in recovered)
+               for phi in topics) / len(topics)
+
+
+def cluster_quality(model, gold):
+    pred = cluster.Clustering.from_model(model)
+    return cluster.ari(cluster.Contingency(gold, pred))
+
+
+class Recorder(basic.IterationHandler):
+    """Records timing, memory and quality, excluding its own cost"""
+
+    def __init__(self, quality):
+        self.quality = quality
+        self.rows = []
+        self.elapsed = 0
+        self.last_time = time.time()
+
+    def handle(self, model):
+        iter_time = time.time() - self.last_time
+        self.elapsed += iter_time
+        tokens_sec = sum(model.N) / iter_time if iter_time else float('inf')
+        self.rows.append((model.num_iters, self.elapsed, iter_time,
+                          tokens_sec, handler.peak_rss(), self.quality(model)))
+        self.last_time = time.time()
+
+
+def run(args, name, algorithm, corpus, quality):
+    random.seed(args.seed)
+    model = MODELS[name](corpus, args.T, .1, .01)
+    try:
+        params = (1,) if algorithm.startswith('annealed') else ()
+        model.set_inference(algorithm, *params)
+    except RuntimeError as e: # eg numpy backends under PyPy
+        print name, repr(algorithm), 'skipped:', e
+        return
+
+    recorder = Recorder(quality)
+    model.register_handler(recorder)
+    recorder.last_time = time.time()
+    model.inference(args.iterations)
+
+    dirname = '{}-{}'.format(name, algorithm.replace(' ', '-'))
+    filename = os.path.join(args.outdir, dirname, str(args.seed))
+    if not os.path.isdir(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+    with open(filename, 'w') as outfile:
+        print >> outfile, '# {} {}'.format(platform.python_implementation(),
+                                           platform.python_version())
+        print >> outfile, '# M={} V={} T={} L={}'.format(args.M, args.V,
+                                                        args.T, args.L)
+        print >> outfile, ('# iteration seconds seconds/iteration tokens/sec'
+                           ' peak-rss-mb quality')
+        for row in recorder.rows:
+            print >> outfile, ' '.join(str(col) for col in row)
+
+    last = recorder.rows[-1]
+    print name, repr(algorithm), 'sec/iter', last[1] / len(recorder.rows),
+    print 'tokens/sec', sum(model.N) * len(recorder.rows) / last[1],
+    print 'rss', last[4], 'quality', last[5]
+
+
+if __name__ == '__main__':
+    args = get_args()
+
+    for name in args.models:
+        random.seed(args.seed)
+        if name == 'lda':
+            corpus, topics, _ = synthetic.lda_corpus(args.M, args.V, args.T,
+                                                     args.L, .1, .01)
+            quality = lambda model: topic_quality(model, topics)
+        else:
+            corpus, _, _ = synthetic.mixture_corpus(args.M, args.V, args.T,
+                                                    args.L, 2, .01)
+            gold = cluster.Clustering.from_corpus(corpus)
+            quality = lambda model: cluster_quality(model, gold)
+
+        algorithms = args.algorithms or sorted(MODELS[name].algorithms)
+        for algorithm in algorithms:
+            if algorithm not in MODELS[name].algorithms:
+                continue
+            # a fresh process per run keeps the peak rss of runs separate
+            proc = multiprocessing.Process(target=run, args=(
+                args, name, algorithm, corpus, quality))
+            proc.start()
+            proc.join()
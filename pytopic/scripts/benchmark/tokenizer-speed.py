@@ -0,0 +1,32 @@
+#!/usr/bin/pypy
+
+import sys
+import time
+from pytopic.pipeline import dataset, tokenizer
+
+TOKENIZERS = {'plain': dataset.Tokenizer,
+              'news': tokenizer.NewsTokenizer,
+              'bible': tokenizer.BibleTokenizer,
+              'html': tokenizer.HTMLTokenizer}
+
+def time_read(filenames, tokenizer_class, fast):
+    tokenizer = tokenizer_class()
+    tokenizer.fast = fast
+    reader = dataset.CorpusReader(tokenizer)
+    for filename in filenames:
+        reader.add_file(filename)
+
+    start_time = time.time()
+    corpus = reader.read()
+    return time.time() - start_time, len(corpus.vocab)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] not in TOKENIZERS:
+        print 'usage: {} {{{}}} file...'.format(sys.argv[0],
+                                               ','.join(sorted(TOKENIZERS)))
+        sys.exit(1)
+
+    tokenizer_class = TOKENIZERS[sys.argv[1]]
+    for fast in [False, True]:
+        seconds, V = time_read(sys.argv[2:], tokenizer_class, fast)
+        print sys.argv[1], 'fast' if fast else 'regex', seconds, V
@@ -2,7 +2,7 @@ from pytopic.pipeline import dataset, tokenizer, preprocess
 from pytopic.analysis import xref
 from pytopic.util import data
 
-@data.pickle_cache('../pickle/bible-corpus.pickle')
+@data.file_cache('../pickle')
 def get_corpus():
     reader = dataset.CorpusReader(tokenizer.BibleTokenizer())
     reader.add_file('../data/bible/bible.txt')
@@ -15,13 +15,16 @@ def get_corpus():
     return corpus
 
 
-@data.pickle_cache('../pickle/bible-xrefs.pickle')
+@data.file_cache('../pickle')
 def get_xrefs(corpus):
     reader = xref.XRefReader(corpus)
     reader.add_file('../data/bible/xref.txt')
     return reader.read()
 
 
-@data.pickle_cache('../pickle/bible-concord.pickle')
+@data.file_cache('../pickle')
 def get_concordance(corpus):
-    return xref.Concordance(corpus)
+    # the cache only stores the path, so loading memory-maps the index
+    concordance = xref.PostingIndex.from_corpus(corpus, positional=True)
+    concordance.save(data.cache_entry_dir())
+    return concordance
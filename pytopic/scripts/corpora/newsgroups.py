@@ -2,7 +2,7 @@ from pytopic.pipeline import dataset, tokenizer, preprocess
 from pytopic.analysis import cluster
 from pytopic.util import data
 
-@data.pickle_cache('../pickle/newsgroups-corpus.pickle')
+@data.file_cache('../pickle')
 def get_corpus():
     reader = dataset.CorpusReader(tokenizer.NewsTokenizer())
     reader.add_dir('../data/newsgroups/groups')
@@ -15,6 +15,6 @@ def get_corpus():
     return corpus
 
 
-@data.pickle_cache('../pickle/newsgroups-clustering.pickle')
+@data.file_cache('../pickle')
 def get_clustering(corpus):
     return cluster.Clustering.from_corpus(corpus)
@@ -5,7 +5,7 @@ from scripts.corpora import newsgroups
 def get_model(corpus, clustering):
     model = mixmulti.MixtureMultinomial(corpus, 20, 2, .001)
     model.register_handler(handler.Timer())
-    model.register_handler(handler.ClusterConvergeceCheck(model.k))
+    model.register_handler(handler.ClusterConvergeceCheck())
     model.register_handler(handler.MetricPrinter(5, clustering))
     return model
 
@@ -0,0 +1,18 @@
+import argparse
+from pytopic.model import serve
+from scripts.corpora import newsgroups
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('snapshot', help='Snapshot of a model of 20ng')
+    parser.add_argument('-c', '--clusters', action='store_true',
+                        help='Snapshot is of a MixtureMultinomial')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    corpus = newsgroups.get_corpus()
+    server_type = serve.ClusterServer if args.clusters else serve.TopicServer
+    server = server_type.from_snapshot(args.snapshot, corpus.vocab)
+    server.serve()
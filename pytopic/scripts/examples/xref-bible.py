@@ -0,0 +1,17 @@
+from pytopic.model import vanilla
+from pytopic.analysis import xref
+from pytopic.util import handler
+from scripts.corpora import bible
+
+if __name__ == '__main__':
+    corpus = bible.get_corpus()
+    gold = bible.get_xrefs(corpus)
+
+    lda = vanilla.VanillaLDA(corpus, 100, .1, .01)
+    lda.register_handler(handler.Timer())
+    lda.set_inference('sparse gibbs')
+    lda.inference(100)
+
+    index = xref.SimilarityIndex.from_model(lda)
+    print 'Exact', xref.f_measure(gold, index.xrefs(corpus, 10))
+    print 'LSH', xref.f_measure(gold, index.xrefs(corpus, 10, True))
@@ -20,7 +20,7 @@ def get_args():
 
 def get_model(corpus, clustering, K, gamma, beta):
     model = mixmulti.MixtureMultinomial(corpus, K, gamma, beta)
-    model.register_handler(handler.ClusterConvergeceCheck(model.k))
+    model.register_handler(handler.ClusterConvergeceCheck())
     model.register_handler(handler.StateTimePrinter(model.k))
     return model
 